@@ -0,0 +1,189 @@
+# Admission control: per-lane concurrency and queue limits for inbound webhooks
+
+import contextvars
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class LaneFull(RuntimeError):
+    """A lane has no free slot and its queue is full (or the wait timed out)"""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Lane {lane} is full")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    """At most `concurrency` requests run at once; up to `queue_limit` more wait.
+
+    Work that is accepted now but started later (e.g. handed to an executor)
+    reserves its place first, so it counts against the queue limit while it
+    is pending. Latency is measured from arrival (including queueing) to
+    completion and compared against the lane's SLO.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, slo_seconds: float,
+                 max_wait: float = 5.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.slo = slo_seconds
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.pending = 0
+        self.admitted = 0
+        self.shed = 0
+        self.deferred = 0
+        self.slo_misses = 0
+        self.wait_latency = LatencyRecorder()
+        self.latency = LatencyRecorder()
+
+    def reserve(self) -> bool:
+        """Hold a queue place for work that will acquire() later; False when the lane is full"""
+        with self._cond:
+            if self.active + self.waiting + self.pending >= self.concurrency + self.queue_limit:
+                self.shed += 1
+                return False
+            self.pending += 1
+            return True
+
+    def count(self, admitted: bool):
+        """Account work admitted or shed elsewhere (e.g. by a shard queue)"""
+        with self._cond:
+            if admitted:
+                self.admitted += 1
+            else:
+                self.shed += 1
+
+    def acquire(self, block: bool = False, reserved: int = 0) -> bool:
+        """Take a slot; without block, give up when the queue is full or max_wait passes.
+
+        reserved is the number of reserve() calls this acquisition consumes.
+        """
+        with self._cond:
+            self.pending = max(0, self.pending - reserved)
+            if self.active >= self.concurrency:
+                if not block and self.waiting >= self.queue_limit:
+                    self.shed += 1
+                    return False
+                self.waiting += 1
+                try:
+                    ok = self._cond.wait_for(lambda: self.active < self.concurrency,
+                                             None if block else self.max_wait)
+                finally:
+                    self.waiting -= 1
+                if not ok:
+                    self.shed += 1
+                    return False
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self, seconds: float):
+        with self._cond:
+            self.active -= 1
+            self.slo_misses += 1 if seconds > self.slo else 0
+            self._cond.notify()
+        self.latency.record(seconds)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            admitted, misses = self.admitted, self.slo_misses
+            counters = {'active': self.active, 'waiting': self.waiting, 'pending': self.pending, 'admitted': admitted,
+                        'shed': self.shed, 'deferred': self.deferred, 'slo_misses': misses}
+        return {
+            'concurrency': self.concurrency,
+            'queue_limit': self.queue_limit,
+            'slo_ms': round(self.slo * 1000),
+            **counters,
+            'slo_met': round(1 - misses / admitted, 4) if admitted else 1.0,
+            'wait': self.wait_latency.summary(),
+            'latency': self.latency.summary(),
+        }
+
+
+class AdmissionController:
+    """Priority lanes for webhook handling, highest priority first.
+
+    Lanes are isolated, so a flood in one cannot take the slots of another.
+    Work for the lowest lane can be deferred to a bounded background queue
+    instead of being rejected.
+    """
+
+    def __init__(self, lanes: Dict[str, Lane], defer_limit: int = 0, retry_after: int = 5):
+        self.lanes = lanes
+        self.lowest = list(lanes)[-1]
+        self.retry_after = retry_after
+        self._deferred = queue.Queue(maxsize=defer_limit) if defer_limit > 0 else None
+        self._drainer = None
+        self._drainer_lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, name: str, block: bool = False, reserved: int = 0, arrived: float = None):
+        """Run the body in lane `name`; raises LaneFull instead when it is saturated.
+
+        arrived (a time.perf_counter() value) backdates the latency to when the
+        work was accepted, for work that was reserved earlier.
+        """
+        lane = self.lanes[name]
+        arrived = time.perf_counter() if arrived is None else arrived
+        if not lane.acquire(block, reserved):
+            raise LaneFull(name, self.retry_after)
+        lane.wait_latency.record(time.perf_counter() - arrived)
+        try:
+            yield lane
+        finally:
+            lane.release(time.perf_counter() - arrived)
+
+    def reserve(self, name: str):
+        """Reserve a place in lane `name` for work started later; raises LaneFull when it is full"""
+        if not self.lanes[name].reserve():
+            raise LaneFull(name, self.retry_after)
+
+    def defer(self, handler: Callable, *args):
+        """Queue handler(*args) to run in the lowest lane once it has room; raises LaneFull if no room"""
+        if self._deferred is None:
+            raise LaneFull(self.lowest, self.retry_after)
+        try:
+            self._deferred.put_nowait((contextvars.copy_context(), handler, args))
+        except queue.Full:
+            raise LaneFull(self.lowest, self.retry_after) from None
+        self.lanes[self.lowest].deferred += 1
+        with self._drainer_lock:
+            if self._drainer is None:
+                self._drainer = threading.Thread(target=self._drain, name='admission-deferred', daemon=True)
+                self._drainer.start()
+
+    def _drain(self):
+        while True:
+            context, handler, args = self._deferred.get()
+            try:
+                with self.admit(self.lowest, block=True):
+                    context.run(handler, *args)
+            except Exception as e:
+                logger.error(f"Error handling deferred webhook: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'lanes': {name: lane.stats() for name, lane in self.lanes.items()},
+            'deferred_queued': self._deferred.qsize() if self._deferred is not None else 0,
+        }
+
+
+def admission_from_config(config) -> AdmissionController:
+    lanes = {}
+    for name, (concurrency, queue_limit, slo_ms) in config.ADMISSION_LANES.items():
+        lanes[name] = Lane(name, concurrency, queue_limit, slo_ms / 1000, config.ADMISSION_MAX_WAIT_SECONDS)
+    defer_limit = config.ADMISSION_DEFER_LIMIT if config.ADMISSION_SHED_MODE == 'defer' else 0
+    return AdmissionController(lanes, defer_limit)
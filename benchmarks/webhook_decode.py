@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark webhook payload parsing: the old request.get_json() + .get() chains
+against the webhook_events fast path.
+
+Usage: python benchmarks/webhook_decode.py [iterations]
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytz
+
+import webhook_events
+
+
+def make_payload(group_name: str) -> bytes:
+    return json.dumps({
+        "id": "3EB0C767D82C1F8F5A5B",
+        "uuid": "MSG1f1e2d3c4b5a",
+        "created_at": "2025-08-15T07:56:11",
+        "sent_by": "user",
+        "channel_phone_number": "+353870000000",
+        "message": {"text": "Finished both classes this week, feeling great!"},
+        "participant": {"phone_number": "+353871111111", "pushname": "Aoife", "is_admin": False},
+        "group": {
+            "uuid": "WAG6f2a9d1e-1c2b-4d3e-8f9a-0b1c2d3e4f5a",
+            "wa_group_name": group_name,
+            "wa_created_at": "2024-01-10T09:00:00Z",
+            "profile_pic_url": "https://example.invalid/pic.jpg",
+            "participants_count": 42,
+        },
+    }).encode('utf-8')
+
+
+def legacy_parse(raw: bytes, tz):
+    """What the Flask handler + process_webhook_message did before the decoder"""
+    webhook_data = json.loads(raw)
+    created_at = webhook_data.get('created_at', '')
+    message_obj = webhook_data.get('message', {})
+    participant = webhook_data.get('participant', {})
+    group_info = webhook_data.get('group', {})
+    result = (
+        webhook_data.get('id', ''),
+        webhook_data.get('sent_by', ''),
+        message_obj.get('text', ''),
+        participant.get('phone_number', ''),
+        participant.get('pushname', ''),
+        group_info.get('uuid', '') if group_info else '',
+        group_info.get('wa_group_name', '') if group_info else '',
+        group_info.get('wa_created_at', '') if group_info else '',
+        webhook_data.get('channel_phone_number', ''),
+    )
+    if 'pilates' not in result[6].lower():
+        return None
+    group_created_at = result[7]
+    datetime.fromisoformat(group_created_at.replace('Z', '+00:00')).astimezone(tz)
+    msg_datetime = datetime.fromisoformat(created_at)
+    if msg_datetime.tzinfo is None:
+        msg_datetime = msg_datetime.replace(tzinfo=pytz.UTC)
+    msg_datetime.astimezone(tz)
+    return result
+
+
+def fast_parse(raw: bytes, tz):
+    try:
+        return webhook_events.decode_group_message(raw)
+    except webhook_events.IgnoredEvent:
+        return None
+
+
+def bench(label: str, func, payloads, iterations: int, tz):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for raw in payloads:
+            func(raw, tz)
+    elapsed = time.perf_counter() - start
+    per_op = elapsed / (iterations * len(payloads)) * 1e6
+    print(f"  {label:<10} {per_op:8.2f} µs/payload")
+    return per_op
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tz = pytz.timezone('Europe/Dublin')
+    parser = 'orjson' if webhook_events.orjson is not None else 'json'
+    print(f"Fast path JSON parser: {parser}, {iterations} iterations")
+
+    for label, payloads in (
+        ("pilates group", [make_payload("Tuesday Pilates Crew")]),
+        ("other group", [make_payload("Five-a-side football")]),
+        ("90% other", [make_payload("Family chat")] * 9 + [make_payload("Pilates Beginners")]),
+    ):
+        print(f"{label}:")
+        legacy = bench("legacy", legacy_parse, payloads, iterations, tz)
+        fast = bench("fast path", fast_parse, payloads, iterations, tz)
+        print(f"  speedup    {legacy / fast:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -36,4 +36,112 @@ Please focus on current week, not the previous weeks or the future one or the en
 Message: "{message_text}"
 
 Respond with only "YES" or "NO".
-"""
\ No newline at end of file
+"""
+
+# Same question in a few tokens, used when GEMINI_SHORT_CLASSIFIER_PROMPT is on
+GEMINI_ANALYSIS_PROMPT_SHORT = """Did the sender complete any pilates training or class this week?
+Message: "{message_text}"
+Respond with only "YES" or "NO".
+"""
+
+AUTO_REPLY_PROMPT = """
+You are a friendly pilates instructor bot. You previously sent this message to a member who didn't complete their weekly pilates plan:
+"{original_message}"
+
+The member ({user_name}) has now replied with:
+"{user_response}"
+
+Generate a supportive, encouraging, and personalized response to their message. Keep it friendly and motivating. Consider their response and provide appropriate support or encouragement for their pilates journey.
+
+Response should be in a conversational tone and not too long (2-3 sentences maximum).
+"""
+
+VARIED_MESSAGE_PROMPT = """Give me one similar message related to this, not change names. It's about pilates class training. Only answer the message, no other text.
+Message: '{message}'"""
+
+# Prompt Settings
+PROMPT_MAX_INPUT_CHARS = int(os.getenv('PROMPT_MAX_INPUT_CHARS', '1000'))  # Longer member messages are truncated
+GEMINI_SHORT_CLASSIFIER_PROMPT = os.getenv('GEMINI_SHORT_CLASSIFIER_PROMPT', 'false').lower() == 'true'
+GEMINI_CLASSIFIER_MODEL = os.getenv('GEMINI_CLASSIFIER_MODEL', '')  # e.g. gemini-2.5-flash-lite, empty = main model
+# USD per million (input, output) tokens, for the cost totals on /metrics
+GEMINI_PRICES = {
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-flash-lite': (0.10, 0.40),
+}
+
+# Startup Settings
+# When enabled the webhook endpoint comes up first; state loading, Gemini setup,
+# the ngrok tunnel and webhook subscription follow in a background thread
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'false').lower() == 'true'
+
+# Traffic Capture Settings (for offline replay with replay.py)
+WEBHOOK_CAPTURE_FILE = os.getenv('WEBHOOK_CAPTURE_FILE', '')  # e.g. captures/webhooks.jsonl.gz, empty = off
+WEBHOOK_CAPTURE_SALT = os.getenv('WEBHOOK_CAPTURE_SALT', '')  # Key for pseudonymising phone numbers and names
+WEBHOOK_CAPTURE_SALT_FILE = os.getenv('WEBHOOK_CAPTURE_SALT_FILE', 'capture_salt.key')  # Generated and kept here when no salt is set
+WEBHOOK_CAPTURE_REDACT_TEXT = os.getenv('WEBHOOK_CAPTURE_REDACT_TEXT', 'false').lower() == 'true'
+
+# Multi-tenant Settings
+# JSON list of {"bot_number": "...", "api_key": "...", "send_rate_per_second": 1.0};
+# when set, every listed number is hosted in this process and TWOCHAT_API_KEY/BOT_NUMBER are not used
+TENANTS_FILE = os.getenv('TENANTS_FILE', '')
+
+# Sharding Settings
+# Number of worker processes that own group progress (hashed by group uuid); 1 = no sharding.
+# Not combined with TENANTS_FILE.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+# Group chatter is shed (see Admission Control) once its shard has this many messages queued
+SHARD_CHATTER_MAX_BACKLOG = int(os.getenv('SHARD_CHATTER_MAX_BACKLOG', '1000'))
+# Longest wait for every shard to answer a command other than the report/reset, which are waited for
+# as long as a shard runs; shards that exited are not waited for
+SHARD_COMMAND_TIMEOUT_SECONDS = float(os.getenv('SHARD_COMMAND_TIMEOUT_SECONDS', '3600'))
+
+# Auto Reply Settings
+# Private messages from one member arriving within this many seconds are answered with one reply
+AUTO_REPLY_COALESCE_SECONDS = float(os.getenv('AUTO_REPLY_COALESCE_SECONDS', '3'))
+AUTO_REPLY_WORKERS = int(os.getenv('AUTO_REPLY_WORKERS', '8'))  # Conversations answered in parallel
+# Stream the Gemini reply; with pipelined send its first sentence is sent as soon as it is complete
+AUTO_REPLY_STREAMING = os.getenv('AUTO_REPLY_STREAMING', 'true').lower() == 'true'
+AUTO_REPLY_PIPELINED_SEND = os.getenv('AUTO_REPLY_PIPELINED_SEND', 'false').lower() == 'true'
+# Sent if the reply is not out after this many seconds, empty = off
+AUTO_REPLY_QUICK_ACK = os.getenv('AUTO_REPLY_QUICK_ACK', '')
+AUTO_REPLY_QUICK_ACK_AFTER_SECONDS = float(os.getenv('AUTO_REPLY_QUICK_ACK_AFTER_SECONDS', '4'))
+
+# Tracing Settings
+# Per-request spans: '' = off, 'file' = JSON lines to TRACE_FILE, 'otlp' = OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', '').lower()
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces/spans.jsonl')
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+# Enables GET /debug/profile?seconds=N (stack sampling only while a capture runs)
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+
+# Persistence Settings
+# Weekly progress and auto-reply members are written at most this long after a change,
+# so a crash loses at most this window; 0 = write synchronously on every change
+PERSIST_INTERVAL_MS = int(os.getenv('PERSIST_INTERVAL_MS', '1000'))
+
+# Ingress Settings
+# Public base URL of this bot behind your own load balancer / reverse proxy,
+# e.g. https://bot.example.com; when set, no ngrok tunnel is opened
+PUBLIC_URL = os.getenv('PUBLIC_URL', '')
+WEBHOOK_SELF_TEST_EVENTS = int(os.getenv('WEBHOOK_SELF_TEST_EVENTS', '5'))  # Synthetic /webhook posts at startup, 0 = off
+
+# Admission Control Settings
+# Webhook lanes, highest priority first: (concurrency, queue limit, latency SLO in ms).
+# Group messages matching COMPLETION_HINT_PATTERN go to 'completion', the rest to 'chatter'
+ADMISSION_LANES = {
+    'private': (int(os.getenv('ADMISSION_PRIVATE_CONCURRENCY', '8')), int(os.getenv('ADMISSION_PRIVATE_QUEUE', '32')), 500),
+    'completion': (int(os.getenv('ADMISSION_COMPLETION_CONCURRENCY', '8')), int(os.getenv('ADMISSION_COMPLETION_QUEUE', '32')), 5000),
+    'chatter': (int(os.getenv('ADMISSION_CHATTER_CONCURRENCY', '2')), int(os.getenv('ADMISSION_CHATTER_QUEUE', '4')), 10000),
+}
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', '5'))
+ADMISSION_SHED_MODE = os.getenv('ADMISSION_SHED_MODE', 'reject')  # 'reject' (429) or 'defer' (202, handled later)
+ADMISSION_DEFER_LIMIT = int(os.getenv('ADMISSION_DEFER_LIMIT', '1000'))
+COMPLETION_HINT_PATTERN = os.getenv(
+    'COMPLETION_HINT_PATTERN',
+    r'\b(done|did|finish\w*|complet\w*|train\w*|class(es)?|sessions?|workouts?|reformers?|mats?|went|attended)\b'
+    r'|✅|💪|🧘|🏋')
+
+# Admin Settings
+# Bearer token for /metrics, /history/* and /debug/profile; without it those
+# routes only answer direct (not proxied or tunnelled) requests from localhost
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
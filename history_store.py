@@ -0,0 +1,198 @@
+# Multi-week completion history, partitioned by week
+
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from state_io import load_state, write_state
+
+logger = logging.getLogger(__name__)
+
+
+def _bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class HistoryStore:
+    """Completion history kept as one partition per week.
+
+    Phone numbers are dictionary-encoded per group into an append-only list
+    (members.json), and each week's partition (week-YYYY-MM-DD.json) stores,
+    per group, a roster bitmap and a completed bitmap over those positions.
+    Everything is held in memory after load, so queries are a few bitwise
+    operations per week and stay in the millisecond range for years of data.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._members: Dict[str, List[str]] = {}
+        self._positions: Dict[str, Dict[str, int]] = {}
+        self._partitions: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self._weeks: List[str] = []
+        self._lock = threading.RLock()
+
+    @property
+    def members_file(self) -> str:
+        return os.path.join(self.directory, 'members.json')
+
+    def partition_file(self, week_start: str) -> str:
+        return os.path.join(self.directory, f"week-{week_start}.json")
+
+    def load(self):
+        """Load the member dictionaries and every week partition"""
+        with self._lock:
+            try:
+                members, _ = load_state(self.members_file)
+                if members is not None:
+                    self._members = members
+                    self._positions = {uuid: {phone: i for i, phone in enumerate(numbers)}
+                                       for uuid, numbers in self._members.items()}
+
+                self._partitions = {}
+                if os.path.isdir(self.directory):
+                    for name in os.listdir(self.directory):
+                        if name.startswith('week-') and name.endswith('.json'):
+                            partition, _ = load_state(os.path.join(self.directory, name))
+                            if partition is None:
+                                continue
+                            self._partitions[name[5:-5]] = {
+                                uuid: (int(roster, 16), int(completed, 16))
+                                for uuid, (roster, completed) in partition.items()
+                            }
+                self._weeks = sorted(self._partitions)
+                logger.info(f"Loaded {len(self._weeks)} weeks of history from {self.directory}")
+            except Exception as e:
+                logger.error(f"Error loading history: {e}")
+
+    def _position(self, group_uuid: str, phone_number: str) -> int:
+        positions = self._positions.setdefault(group_uuid, {})
+        pos = positions.get(phone_number)
+        if pos is None:
+            numbers = self._members.setdefault(group_uuid, [])
+            pos = positions[phone_number] = len(numbers)
+            numbers.append(phone_number)
+        return pos
+
+    def _mask(self, group_uuid: str, numbers: Iterable[str]) -> int:
+        mask = 0
+        for phone_number in numbers:
+            mask |= 1 << self._position(group_uuid, phone_number)
+        return mask
+
+    def record_week(self, week_start: str, groups: Dict[str, Dict[str, List[str]]]):
+        """Merge a week's {"roster": [...], "completed": [...]} per group into its partition"""
+        if not week_start or not groups:
+            return
+        with self._lock:
+            partition = self._partitions.setdefault(week_start, {})
+            for group_uuid, week in groups.items():
+                completed = self._mask(group_uuid, week.get('completed', []))
+                roster = self._mask(group_uuid, week.get('roster', [])) | completed
+                old_roster, old_completed = partition.get(group_uuid, (0, 0))
+                partition[group_uuid] = (old_roster | roster, old_completed | completed)
+            self._weeks = sorted(self._partitions)
+            self._save(week_start)
+
+    def _save(self, week_start: str):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Members first: a partition never refers to positions missing from members.json
+            write_state(self.members_file, self._members, indent=None)
+            write_state(self.partition_file(week_start),
+                        {uuid: [format(roster, 'x'), format(completed, 'x')]
+                         for uuid, (roster, completed) in self._partitions[week_start].items()}, indent=None)
+            logger.info(f"Saved history partition for week {week_start}")
+        except Exception as e:
+            logger.error(f"Error saving history: {e}")
+
+    def weeks(self) -> List[str]:
+        return list(self._weeks)
+
+    def _group_weeks(self, group_uuid: str, weeks: int = 0) -> List[Tuple[str, int, int]]:
+        """(week, roster, completed) for consecutive weeks, newest first.
+
+        Walks back week by week from the newest partition to the group's first
+        recorded week. A week with no entry for the group counts as nobody
+        completed, over the roster of the next recorded week.
+        """
+        recorded = [week for week in self._weeks if group_uuid in self._partitions[week]]
+        if not recorded:
+            return []
+        first = date.fromisoformat(recorded[0])
+        week = date.fromisoformat(self._weeks[-1])
+        roster = self._partitions[recorded[-1]][group_uuid][0]
+        result = []
+        while week >= first and not (weeks and len(result) == weeks):
+            key = week.isoformat()
+            entry = self._partitions.get(key, {}).get(group_uuid)
+            completed = 0
+            if entry is not None:
+                roster, completed = entry
+            result.append((key, roster, completed))
+            week -= timedelta(days=7)
+        return result
+
+    def completion_rate(self, group_uuid: str, weeks: int = 4) -> Dict:
+        """Share of rostered members who completed, over the group's last N weeks"""
+        with self._lock:
+            per_week = []
+            rostered = completed_total = 0
+            for week, roster, completed in self._group_weeks(group_uuid, weeks):
+                size, done = roster.bit_count(), (roster & completed).bit_count()
+                rostered += size
+                completed_total += done
+                per_week.append({'week_start': week, 'members': size, 'completed': done,
+                                 'rate': round(done / size, 3) if size else None})
+            return {
+                'group_uuid': group_uuid,
+                'weeks': len(per_week),
+                'rate': round(completed_total / rostered, 3) if rostered else None,
+                'per_week': per_week,
+            }
+
+    def streaks(self, group_uuid: str) -> Dict[str, int]:
+        """Current run of consecutive completed weeks for each member on the latest roster"""
+        with self._lock:
+            history = self._group_weeks(group_uuid)
+            if not history:
+                return {}
+            numbers = self._members.get(group_uuid, [])
+            streaks = {}
+            alive = history[0][1]
+            length = 0
+            for _, _, completed in history:
+                for pos in _bits(alive & ~completed):
+                    streaks[numbers[pos]] = length
+                alive &= completed
+                if not alive:
+                    break
+                length += 1
+            for pos in _bits(alive):
+                streaks[numbers[pos]] = length
+            return streaks
+
+    def member_streaks(self, phone_number: str) -> Dict[str, int]:
+        """Current streak of one member in every group they have history in"""
+        with self._lock:
+            result = {}
+            for group_uuid, positions in self._positions.items():
+                if phone_number in positions:
+                    result[group_uuid] = self.streaks(group_uuid).get(phone_number, 0)
+            return result
+
+    def at_risk(self, group_uuid: str, missed_weeks: int = 2) -> List[str]:
+        """Members on the latest roster who missed each of the group's last N weeks"""
+        with self._lock:
+            history = self._group_weeks(group_uuid, missed_weeks)
+            if len(history) < missed_weeks:
+                return []
+            mask = history[0][1]
+            for _, roster, completed in history:
+                mask &= roster & ~completed
+            numbers = self._members.get(group_uuid, [])
+            return [numbers[pos] for pos in _bits(mask)]
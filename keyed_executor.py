@@ -0,0 +1,105 @@
+# Per-key serialised execution with coalescing of bursts
+
+import contextvars
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Run work one batch at a time per key, and in parallel across keys.
+
+    Items submitted for a key are held for `window` seconds after the first one
+    arrives; everything that arrived by then is handed to the handler as one
+    batch. Items arriving while a batch runs form the next batch, so a key never
+    has two batches in flight and its items are handled in arrival order.
+    """
+
+    def __init__(self, window: float = 0.0, max_workers: int = 8):
+        self.window = window
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='keyed')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending: Dict[Hashable, List[Tuple[Callable, object, contextvars.Context]]] = {}
+        self._active = set()  # keys with a batch waiting for its window or running
+        self._timers: List[Tuple[float, int, Hashable]] = []
+        self._timer_seq = 0
+        self._timer_wakeup = threading.Condition(threading.Lock())
+        self.batches = 0
+        self.coalesced = 0
+        threading.Thread(target=self._timer_loop, name='keyed-timers', daemon=True).start()
+
+    def submit(self, key: Hashable, handler: Callable[[Hashable, List], None], item):
+        """Queue item for key; handler(key, items) runs once per batch.
+
+        The batch runs in a copy of the context its first item was submitted
+        from, so context variables such as the tracing correlation id carry over.
+        """
+        context = contextvars.copy_context()
+        with self._lock:
+            self._pending.setdefault(key, []).append((handler, item, context))
+            if key in self._active:
+                return
+            self._active.add(key)
+        self._schedule(key)
+
+    def _schedule(self, key: Hashable):
+        if self.window <= 0:
+            self._pool.submit(self._run, key)
+            return
+        with self._timer_wakeup:
+            self._timer_seq += 1
+            heapq.heappush(self._timers, (time.monotonic() + self.window, self._timer_seq, key))
+            self._timer_wakeup.notify()
+
+    def _timer_loop(self):
+        while True:
+            with self._timer_wakeup:
+                while not self._timers:
+                    self._timer_wakeup.wait()
+                due, _, key = self._timers[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._timer_wakeup.wait(delay)
+                    continue
+                heapq.heappop(self._timers)
+            self._pool.submit(self._run, key)
+
+    def _run(self, key: Hashable):
+        with self._lock:
+            entries = self._pending.pop(key, [])
+        try:
+            if entries:
+                self.batches += 1
+                self.coalesced += len(entries) - 1
+                handler, _, context = entries[0]
+                context.run(handler, key, [item for _, item, _ in entries])
+        except Exception as e:
+            logger.error(f"Error handling batch for {key}: {e}")
+        finally:
+            with self._lock:
+                more = key in self._pending
+                if not more:
+                    self._active.discard(key)
+                    self._idle.notify_all()
+            if more:
+                self._schedule(key)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until no key has queued or running work"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'active_keys': len(self._active), 'batches': self.batches, 'coalesced': self.coalesced}
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            self.wait_idle()
+        self._pool.shutdown(wait=wait)
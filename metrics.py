@@ -0,0 +1,50 @@
+# Small in-process latency metrics
+
+import threading
+from collections import deque
+from typing import Dict
+
+
+def _nearest_rank(samples, pct: float) -> float:
+    rank = int(round(pct / 100.0 * len(samples))) - 1
+    return samples[max(0, min(len(samples) - 1, rank))]
+
+
+class LatencyRecorder:
+    """Keep the most recent latency samples and summarise them as percentiles"""
+
+    def __init__(self, max_samples: int = 10000):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank percentile of the retained samples, in seconds"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return _nearest_rank(samples, pct)
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean and p50/p90/p99/max in milliseconds"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {'count': count}
+        return {
+            'count': count,
+            'mean_ms': round(total / count * 1000, 3),
+            'p50_ms': round(_nearest_rank(samples, 50) * 1000, 3),
+            'p90_ms': round(_nearest_rank(samples, 90) * 1000, 3),
+            'p99_ms': round(_nearest_rank(samples, 99) * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3),
+        }
@@ -0,0 +1,142 @@
+# Offline stand-ins for the 2Chat HTTP API and the Gemini model, used by the
+# replay tool so a WhatsAppPilatesBot can run without network access
+
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List
+
+COMPLETION_WORDS = re.compile(r"\b(done|did|completed?|finished|attended|went|class|session|trained)\b|✅|💪", re.IGNORECASE)
+
+
+class StubResponse:
+    def __init__(self, status_code: int = 200, data=None):
+        self.status_code = status_code
+        self._data = data if data is not None else {}
+
+    def json(self):
+        return self._data
+
+    @property
+    def text(self) -> str:
+        return str(self._data)
+
+
+class StubHttpSession:
+    """Records 2Chat calls by endpoint and answers them from in-memory data"""
+
+    def __init__(self, groups: List[Dict] = None, group_details: Dict[str, Dict] = None,
+                 latency: float = 0.0, sleep: Callable[[float], None] = time.sleep):
+        self.groups = groups or []
+        self.group_details = group_details or {}
+        self.latency = latency
+        self.sleep = sleep
+        self.calls: Counter = Counter()
+        self.webhooks: List[Dict] = []
+        self._webhook_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        if url.endswith('/send-message'):
+            return 'send_message'
+        if '/groups/messages/' in url:
+            return 'group_messages'
+        if '/groups/' in url:
+            return 'list_groups'
+        if '/group/' in url:
+            return 'group_details'
+        if '/webhooks' in url:
+            return 'webhooks'
+        return 'other'
+
+    def _webhooks(self, method: str, url: str, body) -> StubResponse:
+        with self._lock:
+            if method == 'post' and '/subscribe/' in url:
+                payload = json.loads(body) if isinstance(body, (str, bytes)) else (body or {})
+                hook = {'uuid': f"WHK-stub-{next(self._webhook_ids)}", 'event_name': url.rsplit('/', 1)[-1],
+                        'hook_url': payload.get('hook_url', ''), 'on_number': payload.get('on_number', '')}
+                self.webhooks.append(hook)
+                return StubResponse(200, {'data': hook})
+            if method == 'delete':
+                hook_uuid = url.rsplit('/', 1)[-1]
+                self.webhooks = [hook for hook in self.webhooks if hook['uuid'] != hook_uuid]
+                return StubResponse(200, {'success': True})
+            return StubResponse(200, {'success': True, 'data': list(self.webhooks)})
+
+    def _call(self, method: str, url: str, body=None) -> StubResponse:
+        endpoint = self.endpoint(url)
+        with self._lock:
+            self.calls[endpoint] += 1
+        if self.latency:
+            self.sleep(self.latency)
+
+        if endpoint == 'list_groups':
+            return StubResponse(200, {'data': self.groups})
+        if endpoint == 'group_details':
+            details = self.group_details.get(url.rsplit('/', 1)[-1])
+            return StubResponse(200, {'data': details}) if details else StubResponse(404, {'error': 'not found'})
+        if endpoint == 'webhooks':
+            return self._webhooks(method, url, body)
+        return StubResponse(200, {'success': True})
+
+    def get(self, url, **kwargs):
+        return self._call('get', url)
+
+    def post(self, url, **kwargs):
+        return self._call('post', url, kwargs.get('data') or kwargs.get('json'))
+
+    def delete(self, url, **kwargs):
+        return self._call('delete', url)
+
+
+class StubGeminiModel:
+    """Answers completion prompts with a keyword heuristic and echoes other prompts"""
+
+    model_name = 'stub'
+
+    def __init__(self, latency: float = 0.0, sleep: Callable[[float], None] = time.sleep):
+        self.latency = latency
+        self.sleep = sleep
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def variant(self, model_name: str) -> 'StubGeminiModel':
+        return self
+
+    def _answer(self, prompt: str) -> str:
+        if '"YES" or "NO"' in prompt:
+            message = prompt.rsplit('Message:', 1)[-1]
+            return "YES" if COMPLETION_WORDS.search(message) else "NO"
+        return "Great to hear from you! Keep going with your pilates this week 💪"
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+        answer = self._answer(prompt)
+        if stream:
+            return self._stream(answer)
+        if self.latency:
+            self.sleep(self.latency)
+
+        class Response:
+            text = answer
+
+        return Response()
+
+    def _stream(self, answer: str):
+        # Word-sized chunks with the latency spread evenly over them
+        words = re.findall(r'\S+\s*', answer) or ['']
+        for word in words:
+            if self.latency:
+                self.sleep(self.latency / len(words))
+
+            class Chunk:
+                text = word
+
+            yield Chunk()
@@ -0,0 +1,106 @@
+# Debounced background persistence of in-memory state
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceScheduler:
+    """Coalesces saves of named stores onto a background flusher thread.
+
+    mark_dirty(name) only records that a store changed. A store is written at
+    most `interval` seconds after it first became dirty, so any number of
+    changes inside that window cost a single write, and a crash loses at most
+    `interval` seconds of changes. flush() writes dirty stores immediately, for
+    shutdown and critical events. With interval <= 0 every mark saves inline.
+    """
+
+    def __init__(self, interval: float, clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self._savers: Dict[str, Callable[[], None]] = {}
+        self._save_locks: Dict[str, threading.Lock] = {}
+        self._dirty: Dict[str, float] = {}  # store -> time it first became dirty
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.marks: Dict[str, int] = {}
+        self.writes: Dict[str, int] = {}
+        self.max_delay = 0.0
+
+    def register(self, name: str, save: Callable[[], None]):
+        self._savers[name] = save
+        self._save_locks[name] = threading.Lock()
+        self.marks[name] = 0
+        self.writes[name] = 0
+
+    def mark_dirty(self, name: str):
+        if self.interval <= 0 or self._stopped:
+            self.marks[name] += 1
+            self._save(name, None)
+            return
+        with self._cond:
+            self.marks[name] += 1
+            if name not in self._dirty:
+                self._dirty[name] = self.clock()
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='persistence', daemon=True)
+                self._thread.start()
+
+    def _save(self, name: str, dirty_since):
+        # One writer per store, so a slow older snapshot cannot land after a newer one
+        with self._save_locks[name]:
+            try:
+                self._savers[name]()
+                self.writes[name] += 1
+                if dirty_since is not None:
+                    self.max_delay = max(self.max_delay, self.clock() - dirty_since)
+            except Exception as e:
+                logger.error(f"Error persisting {name}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                now = self.clock()
+                due = {name: since for name, since in self._dirty.items() if now - since >= self.interval}
+                if not due:
+                    self._cond.wait(min(since for since in self._dirty.values()) + self.interval - now)
+                    continue
+                for name in due:
+                    del self._dirty[name]
+            for name, since in due.items():
+                self._save(name, since)
+
+    def flush(self, names: Iterable[str] = None):
+        """Write the given (default: all) dirty stores now, on the calling thread"""
+        with self._cond:
+            wanted = list(self._dirty) if names is None else [name for name in names if name in self._dirty]
+            due = {name: self._dirty.pop(name) for name in wanted}
+        for name, since in due.items():
+            self._save(name, since)
+
+    def stop(self):
+        """Flush everything and save inline from now on"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            dirty = sorted(self._dirty)
+        return {
+            'interval_ms': round(self.interval * 1000),
+            'marks': dict(self.marks),
+            'writes': dict(self.writes),
+            'dirty': dirty,
+            'max_delay_ms': round(self.max_delay * 1000, 3),
+        }
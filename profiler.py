@@ -0,0 +1,68 @@
+# On-demand sampling profiler over all Python threads
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+# Only one capture at a time; nothing is hooked while idle
+_capture_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds: float, interval: float = 0.01, max_depth: int = 64) -> Dict:
+    """Sample every other thread's stack for `seconds`, every `interval` seconds.
+
+    Stacks are aggregated root-first as 'a;b;c' strings (collapsed format, as
+    consumed by flamegraph.pl and speedscope).
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being captured")
+    try:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        functions: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        started = time.perf_counter()
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                leaf = frame
+                labels: List[str] = []
+                while frame is not None and len(labels) < max_depth:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if not labels:
+                    continue
+                functions[f"{labels[0]}:{leaf.f_lineno}"] += 1
+                labels.append(names.get(ident) or f"thread-{ident}")
+                stacks[';'.join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        return {
+            'seconds': round(time.perf_counter() - started, 3),
+            'interval_ms': round(interval * 1000, 3),
+            'samples': samples,
+            'stacks': stacks,
+            'top_functions': functions.most_common(25),
+        }
+    finally:
+        _capture_lock.release()
+
+
+def collapsed(profile: Dict) -> str:
+    """Profile stacks as collapsed-stack text, one 'stack count' line each"""
+    return ''.join(f"{stack} {count}\n" for stack, count in profile['stacks'].most_common())
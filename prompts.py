@@ -0,0 +1,162 @@
+# Gemini prompt templates, input caps and token/cost accounting
+
+import re
+import string
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+from metrics import LatencyRecorder
+
+# Rough token estimate when the response carries no usage metadata
+CHARS_PER_TOKEN = 4
+
+# Fields holding text a member wrote; only these are capped. The bot's own text
+# (e.g. a report listing every name) is passed through whole.
+MEMBER_FIELDS = ('message_text', 'user_response')
+
+
+class PromptTemplate:
+    """A prompt parsed once into literal and field parts.
+
+    Whitespace is normalised at compile time (lines stripped, blank-line runs
+    collapsed) and the capped_fields values are cut to max_input_chars on
+    render, so a long member message cannot blow up the prompt.
+    """
+
+    __slots__ = ('name', 'text', 'fields', 'max_input_chars', 'capped_fields', '_parts')
+
+    def __init__(self, name: str, text: str, max_input_chars: int = 0, capped_fields: Tuple[str, ...] = MEMBER_FIELDS):
+        self.name = name
+        self.text = re.sub(r'\n{3,}', '\n\n', '\n'.join(line.strip() for line in text.strip().splitlines()))
+        self.max_input_chars = max_input_chars
+        self.capped_fields = frozenset(capped_fields)
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(self.text):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"Prompt {name}: only plain {{field}} placeholders are supported")
+            self._parts.append((literal, field))
+            if field and field not in fields:
+                fields.append(field)
+        self.fields = tuple(fields)
+
+    def cap(self, value: str) -> str:
+        value = str(value).strip()
+        if self.max_input_chars and len(value) > self.max_input_chars:
+            return value[:self.max_input_chars].rstrip() + '…'
+        return value
+
+    def render(self, **values) -> str:
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Prompt {self.name} is missing {', '.join(missing)}")
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field:
+                out.append(self.cap(values[field]) if field in self.capped_fields else str(values[field]))
+        return ''.join(out)
+
+    def __len__(self) -> int:
+        """Length of the fixed text, i.e. the per-call overhead before inputs"""
+        return sum(len(literal) for literal, _ in self._parts)
+
+
+def compile_prompts(max_input_chars: int = None) -> Dict[str, PromptTemplate]:
+    """Compile every Gemini prompt from config, capping member text to max_input_chars"""
+    cap = config.PROMPT_MAX_INPUT_CHARS if max_input_chars is None else max_input_chars
+    return {
+        'completion': PromptTemplate('completion', config.GEMINI_ANALYSIS_PROMPT, cap),
+        'completion_short': PromptTemplate('completion_short', config.GEMINI_ANALYSIS_PROMPT_SHORT, cap),
+        'auto_reply': PromptTemplate('auto_reply', config.AUTO_REPLY_PROMPT, cap),
+        'varied_message': PromptTemplate('varied_message', config.VARIED_MESSAGE_PROMPT, cap),
+    }
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def usage_of(response) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, output_tokens) from a Gemini response or final stream chunk, if reported"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    output_tokens = getattr(usage, 'candidates_token_count', None)
+    if prompt_tokens is None:
+        return None
+    return int(prompt_tokens), int(output_tokens or 0)
+
+
+class TokenLedger:
+    """Running Gemini token, cost and latency totals per feature and per group.
+
+    prices maps a model name to (input, output) USD per million tokens; unknown
+    models are counted at zero cost. Callers time calls with clock, which a
+    simulation can replace with its virtual clock.
+    """
+
+    def __init__(self, prices: Dict[str, Tuple[float, float]] = None, clock: Callable[[], float] = time.monotonic):
+        self.prices = prices or {}
+        self.clock = clock
+        self._features: Dict[str, Dict] = {}
+        self._groups: Dict[str, Dict] = {}
+        self._latency: Dict[str, LatencyRecorder] = {}
+        self._lock = threading.Lock()
+
+    def cost(self, model_name: str, prompt_tokens: int, output_tokens: int) -> float:
+        input_price, output_price = self.prices.get(model_name, (0.0, 0.0))
+        return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def record(self, feature: str, model_name: str, prompt: str, output: str,
+               usage: Optional[Tuple[int, int]] = None, seconds: float = 0.0, group_uuid: str = ''):
+        """Account one call, using reported usage when available and estimates otherwise"""
+        if usage:
+            prompt_tokens, output_tokens = usage
+        else:
+            prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(output)
+        cost = self.cost(model_name, prompt_tokens, output_tokens)
+
+        with self._lock:
+            totals = [self._entry(self._features, feature)]
+            if group_uuid:
+                totals.append(self._entry(self._groups, group_uuid))
+            for entry in totals:
+                entry['calls'] += 1
+                entry['estimated_calls'] += 0 if usage else 1
+                entry['prompt_tokens'] += prompt_tokens
+                entry['output_tokens'] += output_tokens
+                entry['cost_usd'] += cost
+                entry['models'][model_name] = entry['models'].get(model_name, 0) + 1
+            recorder = self._latency.get(feature)
+            if recorder is None:
+                recorder = self._latency[feature] = LatencyRecorder()
+        recorder.record(seconds)
+
+    @staticmethod
+    def _entry(table: Dict[str, Dict], key: str) -> Dict:
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = {'calls': 0, 'estimated_calls': 0, 'prompt_tokens': 0,
+                                  'output_tokens': 0, 'cost_usd': 0.0, 'models': {}}
+        return entry
+
+    @staticmethod
+    def _rounded(entry: Dict) -> Dict:
+        return {**entry, 'cost_usd': round(entry['cost_usd'], 6), 'models': dict(entry['models'])}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            features = {name: self._rounded(entry) for name, entry in self._features.items()}
+            groups = {uuid: self._rounded(entry) for uuid, entry in self._groups.items()}
+            recorders = dict(self._latency)
+        for name, recorder in recorders.items():
+            features[name]['latency'] = recorder.summary()
+        return {
+            'features': features,
+            'groups': groups,
+            'total_cost_usd': round(sum(entry['cost_usd'] for entry in features.values()), 6),
+        }
@@ -0,0 +1,52 @@
+# Token-bucket rate limiting for outbound API calls
+
+import threading
+import time
+from typing import Callable, Optional
+
+
+class RateLimiter:
+    """Allow `rate` operations per second on average, with bursts up to `burst`.
+
+    `clock` and `sleep` can be replaced (e.g. by a simulated clock) so the
+    limiter works in dry runs without real waiting.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting"""
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.throttled += 1
+            return False
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available; returns seconds waited"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait:
+                self.throttled += 1
+                self.waited += wait
+        if wait:
+            self.sleep(wait)
+        return wait
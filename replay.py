@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Replay a webhook capture into a WhatsAppPilatesBot with stubbed 2Chat and Gemini.
+
+Usage:
+    python replay.py capture.jsonl.gz [--speed N] [--state-dir DIR] [--report FILE]
+
+--speed 1 replays at the original pace, N at N times the pace, 0 as fast as
+possible. Message timestamps are moved forward by whole weeks so the capture's
+first week lands in the current week (same weekday and time), otherwise the
+previous-week filter would drop everything; --keep-dates turns this off.
+Without --state-dir the pilates groups seen in the capture are
+served by the stubbed 2Chat API and discovered the normal way.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import whatsapp_pilates_bot
+from metrics import LatencyRecorder
+from offline_stubs import StubGeminiModel, StubHttpSession
+from traffic_capture import capture_header, read_capture
+from webhook_events import (IgnoredEvent, WebhookDecodeError, decode_group_message, decode_private_message,
+                            parse_timestamp)
+
+import config
+
+STATE_FILES = ('available_groups.json', 'weekly_progress.json', 'auto_reply_members.json')
+
+
+def groups_from_capture(path: str):
+    """Build 2Chat group listing/details for every pilates group seen in a capture"""
+    details: Dict[str, Dict] = {}
+    for record in read_capture(path):
+        group = record.get('payload', {}).get('group') if 'route' in record else None
+        if not group or config.PILATES_KEYWORD.lower() not in (group.get('wa_group_name') or '').lower():
+            continue
+        entry = details.setdefault(group['uuid'], {
+            'uuid': group['uuid'],
+            'wa_group_name': group.get('wa_group_name', ''),
+            'wa_created_at': group.get('wa_created_at', ''),
+            'participants': {},
+        })
+        phone_number = record['payload'].get('participant', {}).get('phone_number')
+        if phone_number:
+            entry['participants'][phone_number] = {'phone_number': phone_number}
+
+    for entry in details.values():
+        entry['participants'] = list(entry['participants'].values())
+    listing = [{'uuid': uuid, 'wa_group_name': d['wa_group_name']} for uuid, d in details.items()]
+    return listing, details
+
+
+def week_shift(capture: str, week_start: datetime) -> timedelta:
+    """Whole weeks from the week of the capture's first message to week_start"""
+    for record in read_capture(capture):
+        created_at = parse_timestamp(record.get('payload', {}).get('created_at', '')) if 'route' in record else None
+        if created_at is None:
+            continue
+        local = created_at.astimezone(week_start.tzinfo)
+        monday = local.date() - timedelta(days=local.weekday())
+        return timedelta(weeks=max(0, (week_start.date() - monday).days // 7))
+    return timedelta(0)
+
+
+def shift_created_at(payload: Dict, shift: timedelta) -> Dict:
+    """Copy of payload with created_at moved by shift, in the same ISO shape"""
+    created_at = payload.get('created_at')
+    if not shift or not isinstance(created_at, str) or not created_at:
+        return payload
+    zulu = created_at.endswith('Z')
+    try:
+        # fromisoformat only accepts a trailing Z from Python 3.11
+        parsed = datetime.fromisoformat(created_at[:-1] + '+00:00' if zulu else created_at)
+    except ValueError:
+        return payload
+    text = (parsed + shift).isoformat()
+    if zulu:
+        text = text.replace('+00:00', 'Z')
+    return {**payload, 'created_at': text}
+
+
+def snapshot(bot) -> Dict:
+    return {
+        'completed': {uuid: sorted(p.completed_members) for uuid, p in bot.weekly_progress.items()},
+        'analyzed': {uuid: len(p.messages_analyzed) for uuid, p in bot.weekly_progress.items()},
+        'auto_reply_members': sorted(m.phone_number for m in bot.auto_reply_members),
+    }
+
+
+def state_diff(before: Dict, after: Dict) -> Dict:
+    groups = {}
+    for uuid in sorted(set(before['completed']) | set(after['completed'])):
+        was = set(before['completed'].get(uuid, []))
+        now = set(after['completed'].get(uuid, []))
+        analyzed = after['analyzed'].get(uuid, 0) - before['analyzed'].get(uuid, 0)
+        if now != was or analyzed:
+            groups[uuid] = {
+                'newly_completed': sorted(now - was),
+                'messages_analyzed': analyzed,
+            }
+    return {
+        'groups': groups,
+        'auto_reply_members_removed': sorted(set(before['auto_reply_members']) - set(after['auto_reply_members'])),
+        'auto_reply_members_added': sorted(set(after['auto_reply_members']) - set(before['auto_reply_members'])),
+    }
+
+
+def replay(capture: str, speed: float = 0.0, state_dir: str = '', keep_dates: bool = False) -> Dict:
+    header = capture_header(capture) or {}
+    bot_number = header.get('bot_number', '')
+
+    workdir = tempfile.mkdtemp(prefix='pilates-replay-')
+    if state_dir:
+        for name in STATE_FILES:
+            if os.path.exists(os.path.join(state_dir, name)):
+                shutil.copy(os.path.join(state_dir, name), workdir)
+        http = StubHttpSession()
+    else:
+        listing, details = groups_from_capture(capture)
+        http = StubHttpSession(groups=listing, group_details=details)
+
+    model = StubGeminiModel()
+    bot = whatsapp_pilates_bot.WhatsAppPilatesBot('replay', 'replay', bot_number, lazy=True,
+                                                  http=http, model=model, data_dir=workdir)
+    bot.warm_up()
+    http.calls.clear()
+
+    shift: Optional[timedelta] = None if keep_dates else week_shift(capture, bot.week_clock.current()[1])
+
+    before = snapshot(bot)
+    latency = {'/webhook': LatencyRecorder(10 ** 6), '/receive_chat_message': LatencyRecorder(10 ** 6)}
+    lag = LatencyRecorder(10 ** 6)
+    outcomes = {'processed': 0, 'filtered': 0, 'ignored': 0, 'invalid': 0}
+
+    first_arrival = None
+    started = time.monotonic()
+    for record in read_capture(capture):
+        if 'route' not in record:
+            continue
+        if first_arrival is None:
+            first_arrival = record['t']
+        if speed > 0:
+            due = started + (record['t'] - first_arrival) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lag.record(max(0.0, -delay))
+
+        payload = shift_created_at(record['payload'], shift) if shift else record['payload']
+        raw = json.dumps(payload).encode('utf-8')
+        t0 = time.perf_counter()
+        try:
+            if record['route'] == '/receive_chat_message':
+                bot.handle_private_event(decode_private_message(raw))
+                outcomes['processed'] += 1
+            else:
+                event = decode_group_message(raw)
+                dropped = sum(bot.group_filters.stats()['drops'].values())
+                bot.handle_group_event(event)
+                filtered = sum(bot.group_filters.stats()['drops'].values()) > dropped
+                outcomes['filtered' if filtered else 'processed'] += 1
+        except IgnoredEvent:
+            outcomes['ignored'] += 1
+        except WebhookDecodeError:
+            outcomes['invalid'] += 1
+        latency.setdefault(record['route'], LatencyRecorder(10 ** 6)).record(time.perf_counter() - t0)
+    # Auto replies run on the keyed executor; let the last batches finish
+    bot.private_executor.wait_idle()
+    bot.persistence.flush()
+    elapsed = time.monotonic() - started
+
+    total = sum(outcomes.values())
+    report = {
+        'events': total,
+        'outcomes': outcomes,
+        'shifted_days': shift.days if shift else 0,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_per_second': round(total / elapsed, 1) if elapsed else None,
+        'latency': {route: recorder.summary() for route, recorder in latency.items() if recorder.count},
+        'group_filters': bot.group_filters.stats(),
+        'stub_calls': {'gemini': model.calls, **dict(http.calls)},
+        'gemini_tokens': bot.token_ledger.snapshot(),
+        'state_diff': state_diff(before, snapshot(bot)),
+        'workdir': workdir,
+    }
+    if speed > 0:
+        report['schedule_lag'] = lag.summary()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured webhook traffic offline")
+    parser.add_argument('capture', help="capture file written with WEBHOOK_CAPTURE_FILE")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="1 = original pace, N = N times faster, 0 = as fast as possible (default)")
+    parser.add_argument('--state-dir', default='', help="directory with state JSON files to start from")
+    parser.add_argument('--keep-dates', action='store_true',
+                        help="replay message timestamps as captured instead of moving them into the current week")
+    parser.add_argument('--report', default='', help="also write the report as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report = replay(args.capture, args.speed, args.state_dir, args.keep_dates)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+# Sharding group traffic across worker processes by group uuid
+
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+import config
+import tracing
+from state_io import PREVIOUS_SUFFIX, load_state
+from webhook_events import WebhookDecodeError, loads
+
+logger = logging.getLogger(__name__)
+
+# Finds the group uuid without parsing the whole body; falls back to a full parse
+GROUP_UUID_PATTERN = re.compile(rb'"group"\s*:\s*\{[^{}]*?"uuid"\s*:\s*"([^"\\]+)"')
+MESSAGE_TEXT_PATTERN = re.compile(rb'"message"\s*:\s*\{[^{}]*?"text"\s*:\s*("(?:[^"\\]|\\.)*")')
+SHARD_DIR_PATTERN = re.compile(r'shard-(\d+)')
+# Outbox tag of a member reminded during a shard's report (command results carry int tags)
+MEMBER_TAG = 'member'
+
+
+def _hash(value: str) -> int:
+    # md5 rather than hash() so every process agrees on the placement
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of group uuids onto shards, with virtual nodes"""
+
+    def __init__(self, shard_count: int, vnodes: int = 64):
+        points = sorted((_hash(f"shard-{shard}-{vnode}"), shard)
+                        for shard in range(shard_count) for vnode in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> int:
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[i]
+
+
+def group_uuid_of(raw: bytes) -> str:
+    """Group uuid of a raw group webhook body, '' if it has none"""
+    match = GROUP_UUID_PATTERN.search(raw)
+    if match:
+        return match.group(1).decode('utf-8')
+    data = loads(raw)
+    group = data.get('group') if isinstance(data, dict) else None
+    return (group or {}).get('uuid', '') if isinstance(group, dict) else ''
+
+
+def message_text_of(raw: bytes) -> str:
+    """Message text of a raw group webhook body without a full parse, '' if not found"""
+    match = MESSAGE_TEXT_PATTERN.search(raw)
+    if not match:
+        return ''
+    try:
+        return loads(match.group(1))
+    except WebhookDecodeError:
+        return ''
+
+
+def _shard_main(shard_id: int, settings: Dict, inbox, outbox):
+    """Worker process: owns the WeeklyProgress of the groups hashed onto it"""
+    import whatsapp_pilates_bot
+    from webhook_events import decode_group_message
+
+    # Each shard exports its own spans; file exports go to one file per shard
+    if config.TRACE_EXPORT == 'file':
+        config.TRACE_FILE = f"{config.TRACE_FILE}.shard-{shard_id}"
+    tracing.configure(tracing.exporter_from_config(config))
+
+    bot = whatsapp_pilates_bot.WhatsAppPilatesBot(
+        api_key=settings['api_key'],
+        gemini_api_key=settings['gemini_api_key'],
+        bot_number=settings['bot_number'],
+        lazy=True,
+        data_dir=settings['data_dir']
+    )
+    # Groups are discovered by the parent; shards only read its file
+    bot.available_groups_file = settings['groups_file']
+    bot.discover_groups = False
+    seed_needed = not os.path.exists(bot.weekly_progress_file)
+    bot.warm_up()
+    if seed_needed and settings.get('seed_progress'):
+        bot.restore_weekly_progress(settings['seed_progress'])
+        bot.save_weekly_progress()
+
+    while True:
+        kind, tag, body = inbox.get()
+        if kind == 'group':
+            # For group messages the tag carries the web request's correlation id
+            token = tracing.correlation_id.set(tag or '')
+            try:
+                with tracing.span('shard', shard=shard_id):
+                    with tracing.span('decode'):
+                        event = decode_group_message(body)
+                    bot.handle_group_event(event)
+            except WebhookDecodeError:
+                pass
+            finally:
+                tracing.correlation_id.reset(token)
+            continue
+
+        result = None
+        try:
+            if kind == 'report':
+                # Each reminded member goes to the parent as it is sent, ahead of the result
+                week_progress = bot.take_weekly_progress()
+                history = bot.week_history_data(all_groups=False, progress_by_group=week_progress)
+                reminded = bot.run_group_reports(
+                    week_progress, lambda member: outbox.put((MEMBER_TAG, shard_id, asdict(member))))
+                result = {'reminded': len(reminded), 'history': history}
+                bot.persistence.flush()
+            elif kind == 'reset':
+                result = {'history': bot.week_history_data(all_groups=False, progress_by_group=bot.take_weekly_progress())}
+                bot.persistence.flush()
+            elif kind == 'reload_groups':
+                bot.load_available_groups()
+                result = len(bot.available_groups)
+            elif kind == 'stats':
+                result = {**bot.metrics_snapshot(), 'groups_tracked': len(bot.weekly_progress)}
+            elif kind == 'stop':
+                bot.persistence.stop()
+        except Exception as e:
+            logger.error(f"Shard {shard_id} failed on '{kind}': {e}")
+            result = {'error': str(e)}
+        outbox.put((tag, shard_id, result))
+        if kind == 'stop':
+            break
+
+
+class ShardPool:
+    """Process pool where each shard owns the weekly progress of its groups.
+
+    Group webhooks are hashed by group uuid onto a shard and handled there with
+    no cross-process locking. Private messages and auto-replies stay with the
+    parent bot; the Saturday report is a scatter-gather over the shards.
+    """
+
+    def __init__(self, bot, shard_count: int, shard_root: str = '', queue_size: int = 10000):
+        self.bot = bot
+        self.shard_count = shard_count
+        self.shard_root = shard_root or os.path.join(bot.data_dir, 'shards')
+        self.ring = HashRing(shard_count)
+        self._ctx = multiprocessing.get_context('spawn')
+        # Queues exist before the processes so webhooks can be queued during startup
+        self._inboxes = [self._ctx.Queue(maxsize=queue_size) for _ in range(shard_count)]
+        self._outbox = self._ctx.Queue()
+        self._processes: List = []
+        self._tags = itertools.count()
+        self._pending: Dict[int, Dict] = {}
+        self._pending_lock = threading.Lock()
+        self.dispatched = [0] * shard_count
+
+    def _progress_file(self, shard_id: int) -> str:
+        return os.path.join(self.shard_root, f"shard-{shard_id}", 'weekly_progress.json')
+
+    def _collect_stranded_progress(self) -> Dict[str, Dict]:
+        """Progress saved by shards, if any of it sits on a shard that no longer owns the group.
+
+        Shards only take a seed when they have no progress file, so after a
+        SHARD_COUNT change the groups that moved would lose their week. In that
+        case every shard's progress file is moved aside and all of it returned
+        for reseeding under the current placement; otherwise {} is returned.
+        """
+        saved: Dict[int, Dict] = {}
+        if os.path.isdir(self.shard_root):
+            for name in os.listdir(self.shard_root):
+                match = SHARD_DIR_PATTERN.fullmatch(name)
+                if match:
+                    data, _ = load_state(self._progress_file(int(match.group(1))))
+                    if data:
+                        saved[int(match.group(1))] = data
+        stranded = [group_uuid for shard_id, data in saved.items() for group_uuid in data
+                    if self.ring.shard_for(group_uuid) != shard_id]
+        if not stranded:
+            return {}
+
+        logger.warning(f"{len(stranded)} groups have progress on a shard that no longer owns them "
+                       f"(SHARD_COUNT is now {self.shard_count}); reseeding every shard")
+        suffix = f".resharded-{int(time.time())}"
+        progress: Dict[str, Dict] = {}
+        for shard_id, data in saved.items():
+            progress.update(data)
+            path = self._progress_file(shard_id)
+            for candidate in (path, path + PREVIOUS_SUFFIX):
+                if os.path.exists(candidate):
+                    os.replace(candidate, candidate + suffix)
+        return progress
+
+    def start(self):
+        """Spawn the shard processes, handing each the parent's progress for its groups"""
+        self.bot.ensure_warm()
+        seeds: List[Dict] = [{} for _ in range(self.shard_count)]
+        for group_uuid, progress in {**self._collect_stranded_progress(), **self.bot.weekly_progress_data()}.items():
+            seeds[self.ring.shard_for(group_uuid)][group_uuid] = progress
+
+        for shard_id in range(self.shard_count):
+            settings = {
+                'api_key': self.bot.api_key,
+                'gemini_api_key': getattr(self.bot.model, 'api_key', ''),
+                'bot_number': self.bot.bot_number,
+                'data_dir': os.path.join(self.shard_root, f"shard-{shard_id}"),
+                'groups_file': os.path.abspath(self.bot.available_groups_file),
+                'seed_progress': seeds[shard_id],
+            }
+            process = self._ctx.Process(target=_shard_main, name=f"pilates-shard-{shard_id}",
+                                        args=(shard_id, settings, self._inboxes[shard_id], self._outbox),
+                                        daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        threading.Thread(target=self._collect, name='shard-results', daemon=True).start()
+
+        # Once every shard has answered, the seeded progress is owned by the shards
+        self._scatter('stats', timeout=config.SHARD_COMMAND_TIMEOUT_SECONDS)
+        self.bot.take_weekly_progress()
+        self.bot.save_weekly_progress()
+        logger.info(f"Started {self.shard_count} group shards")
+
+    def _collect(self):
+        while True:
+            tag, shard_id, result = self._outbox.get()
+            if tag == MEMBER_TAG:
+                self.bot.add_auto_reply_member(self.bot.auto_reply_members_from_data([result])[0])
+                continue
+            with self._pending_lock:
+                waiting = self._pending.get(tag)
+            if waiting is None:
+                logger.warning(f"Dropped a late answer from shard {shard_id}: {str(result)[:200]}")
+                continue
+            with self._pending_lock:
+                waiting['results'][shard_id] = result
+                if len(waiting['results']) == self.shard_count:
+                    waiting['done'].set()
+
+    def _alive(self, shard_id: int) -> bool:
+        return shard_id < len(self._processes) and self._processes[shard_id].is_alive()
+
+    def _scatter(self, kind: str, timeout: Optional[float] = None) -> List:
+        """Send a command to every shard and gather the results in shard order.
+
+        Waits at most timeout (None: as long as it takes, for the report and
+        reset whose results must not be lost), and no longer once every shard
+        yet to answer has exited; their results are None.
+        """
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else float('inf')
+        next_notice = started + 600
+        tag = next(self._tags)
+        waiting = {'results': {}, 'done': threading.Event()}
+        with self._pending_lock:
+            self._pending[tag] = waiting
+        for shard_id, inbox in enumerate(self._inboxes):
+            if not self._alive(shard_id):
+                continue
+            try:
+                inbox.put((kind, tag, None), timeout=None if timeout is None else max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.error(f"Shard {shard_id} inbox is full, '{kind}' not sent")
+
+        while not waiting['done'].wait(min(1.0, max(0.0, deadline - time.monotonic()))):
+            with self._pending_lock:
+                missing = [shard_id for shard_id in range(self.shard_count) if shard_id not in waiting['results']]
+            if time.monotonic() >= deadline or not any(self._alive(shard_id) for shard_id in missing):
+                break
+            if time.monotonic() >= next_notice:
+                logger.info(f"Still waiting for shards {missing} to answer '{kind}' "
+                            f"after {time.monotonic() - started:.0f}s")
+                next_notice += 600
+        with self._pending_lock:
+            del self._pending[tag]
+            results = [waiting['results'].get(shard_id) for shard_id in range(self.shard_count)]
+        missing = [shard_id for shard_id in range(self.shard_count) if shard_id not in waiting['results']]
+        if missing:
+            dead = [shard_id for shard_id in missing if not self._alive(shard_id)]
+            reason = f"shards {dead} not running" if dead else f"timed out after {timeout:g}s"
+            logger.error(f"Shards {missing} did not answer '{kind}' ({reason})")
+        return results
+
+    def dispatch_group_message(self, raw: bytes, max_backlog: int = 0) -> int:
+        """Queue a raw group webhook on the shard owning its group; returns the shard id.
+
+        With max_backlog, raises queue.Full once that shard already has that
+        many messages waiting, so low-priority traffic leaves room for the rest.
+        """
+        group_uuid = group_uuid_of(raw)
+        if not group_uuid:
+            raise WebhookDecodeError("Non-group message")
+        shard_id = self.ring.shard_for(group_uuid)
+        if max_backlog:
+            try:
+                backlog = self._inboxes[shard_id].qsize()
+            except NotImplementedError:  # macOS
+                backlog = 0
+            if backlog >= max_backlog:
+                raise queue.Full
+        self._inboxes[shard_id].put_nowait(('group', tracing.correlation_id.get(), raw))
+        self.dispatched[shard_id] += 1
+        return shard_id
+
+    def saturday_report(self):
+        """Refresh groups, run every shard's group reports and merge the reminded members"""
+        logger.info("Generating Saturday weekly reports across shards...")
+        self.bot.ensure_warm()
+        if self.bot.refresh_participants():
+            self._scatter('reload_groups', timeout=config.SHARD_COMMAND_TIMEOUT_SECONDS)
+
+        # Shards send each reminded member as it is reminded; _collect adds them
+        self.bot.clear_auto_reply_members()
+        reminded = 0
+        for shard_id, result in enumerate(self._scatter('report')):
+            if result and 'history' in result:
+                reminded += result['reminded']
+                self.bot.archive_week_history(result['history'])
+            else:
+                logger.error(f"Shard {shard_id} report failed: {result}")
+
+        # Rosters of every tracked group, so groups quiet this week still record a missed week
+        self.bot.archive_week_history()
+
+        self.bot.persistence.flush()
+        logger.info(f"Updated auto_reply_members list with {reminded} members")
+
+    def init_weekly_progress(self):
+        logger.info("Initializing weekly progress for new week on all shards...")
+        for shard_id, result in enumerate(self._scatter('reset')):
+            if result and 'history' in result:
+                self.bot.archive_week_history(result['history'])
+            else:
+                logger.error(f"Shard {shard_id} reset failed: {result}")
+        self.bot.archive_week_history(self.bot.week_history_data(self.bot.previous_week_start()))
+        self.bot.find_pilates_groups()
+        self._scatter('reload_groups', timeout=config.SHARD_COMMAND_TIMEOUT_SECONDS)
+
+    def stats(self) -> Dict:
+        return {
+            'shards': self.shard_count,
+            'dispatched': list(self.dispatched),
+            'workers': self._scatter('stats', timeout=5),
+        }
+
+    def schedule_jobs(self, scheduler):
+        scheduler.every().monday.at("00:00").do(self.init_weekly_progress)
+        scheduler.every().saturday.at(config.SATURDAY_REPORT_TIME).do(self.saturday_report)
+
+    def start_scheduler(self):
+        import schedule
+
+        self.schedule_jobs(schedule)
+        while True:
+            schedule.run_pending()
+            time.sleep(60)
+
+    def stop(self):
+        """Have every shard flush its pending state and exit"""
+        if not self._processes:
+            return
+        self._scatter('stop', timeout=10)
+        for process in self._processes:
+            process.join(timeout=5)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Dry-run the Saturday report with stubbed 2Chat and Gemini on a virtual clock.
+
+Usage:
+    python simulate_report.py --groups 2000 --members 40 [--completion-rate 0.3]
+    python simulate_report.py --state-dir data/ [--send-rate 5] [--report FILE]
+
+The report runs against a temporary copy of the state (or synthetic state),
+so nothing is sent and no persisted file is touched. Stub latencies advance
+a virtual clock instead of sleeping, so thousands of groups simulate in
+seconds. The output has the virtual duration and per-phase timeline, peak
+2Chat request rate, call counts, Gemini token/cost estimates and the
+seconds in which sends exceeded --api-limit.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, List
+
+import whatsapp_pilates_bot
+from offline_stubs import StubGeminiModel, StubHttpSession
+from rate_limit import RateLimiter
+from state_io import write_state
+
+import config
+
+STATE_FILES = ('available_groups.json', 'weekly_progress.json', 'auto_reply_members.json')
+
+
+class VirtualClock:
+    """Monotonic time that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.now += seconds
+
+
+class TimedHttpSession(StubHttpSession):
+    """Stub 2Chat session that also records the virtual time of every call"""
+
+    def __init__(self, clock: VirtualClock, **kwargs):
+        super().__init__(sleep=clock.sleep, **kwargs)
+        self.virtual = clock
+        self.log: List[tuple] = []
+
+    def _call(self, method: str, url: str, body=None):
+        self.log.append((self.virtual.now, self.endpoint(url)))
+        return super()._call(method, url, body)
+
+
+class TimedGeminiModel(StubGeminiModel):
+    """Stub Gemini model that records the virtual time of every call"""
+
+    def __init__(self, clock: VirtualClock, latency: float, model_name: str):
+        super().__init__(latency=latency, sleep=clock.sleep)
+        self.virtual = clock
+        self.model_name = model_name  # priced like the real model in the token ledger
+        self.log: List[float] = []
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self.log.append(self.virtual.now)
+        return super().generate_content(prompt, stream=stream, **kwargs)
+
+
+def synthetic_state(bot, groups: int, members: int, completion_rate: float, seed: int = 0):
+    """Write available_groups and weekly_progress files for `groups` groups into the bot's data dir"""
+    rng = random.Random(seed)
+    week_start = bot.get_current_week_start()
+    available, progress = [], {}
+    for g in range(groups):
+        uuid = f"WAG-sim-{g:06d}"
+        numbers = [f"+3538{g:05d}{m:04d}" for m in range(members)] + [bot.bot_number]
+        completed = [number for number in numbers[:-1] if rng.random() < completion_rate]
+        available.append({'uuid': uuid, 'name': f"{config.PILATES_KEYWORD} sim {g}",
+                          'participants': numbers, 'created_at': '2020-01-01T00:00:00Z'})
+        progress[uuid] = {
+            'group_uuid': uuid,
+            'week_start': week_start,
+            'completed_members': completed,
+            'completed_members_info': {number: f"Member {number[-4:]}" for number in completed},
+            'messages_analyzed': [f"sim-{uuid}-{number}" for number in completed],
+        }
+    write_state(bot.available_groups_file, available)
+    write_state(bot.weekly_progress_file, progress)
+
+
+def serve_known_groups(bot, http: StubHttpSession):
+    """Answer group detail calls with the loaded rosters, so the refresh finds no changes"""
+    http.group_details = {
+        group.uuid: {
+            'uuid': group.uuid,
+            'wa_group_name': group.name,
+            'wa_created_at': group.created_at,
+            'participants': [{'phone_number': number}
+                             for number in group.participants.numbers_in(group.participants.members)],
+        }
+        for group in bot.available_groups
+    }
+
+
+def peak_rate(times: List[float], window: float) -> int:
+    """Most events inside any `window`-second sliding window"""
+    peak, start = 0, 0
+    for end, t in enumerate(times):
+        while t - times[start] >= window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+def violations(times: List[float], limit: int) -> Dict:
+    """Sends that were the (limit+1)th or later inside a one-second sliding window"""
+    over, worst, start, first = 0, 0, 0, None
+    for end, t in enumerate(times):
+        while t - times[start] >= 1.0:
+            start += 1
+        in_window = end - start + 1
+        if in_window > limit:
+            over += 1
+            worst = max(worst, in_window)
+            first = t if first is None else first
+    return {'limit_per_second': limit, 'sends_over_limit': over, 'worst_window': worst,
+            'first_at_seconds': round(first, 3) if first is not None else None}
+
+
+def timeline(http_log: List[tuple], gemini_log: List[float], bucket: float) -> List[Dict]:
+    rows: Dict[int, Counter] = {}
+    for t, endpoint in http_log:
+        rows.setdefault(int(t // bucket), Counter())[endpoint] += 1
+    for t in gemini_log:
+        rows.setdefault(int(t // bucket), Counter())['gemini'] += 1
+    return [{'t_seconds': round(index * bucket, 3), **dict(counts)} for index, counts in sorted(rows.items())]
+
+
+def simulate(state_dir: str = '', groups: int = 100, members: int = 30, completion_rate: float = 0.3,
+             http_latency: float = 0.15, gemini_latency: float = 0.8, send_rate: float = 0.0,
+             api_limit: int = 5, bucket: float = 60.0, price_model: str = 'gemini-2.5-flash',
+             keep: bool = False) -> Dict:
+    clock = VirtualClock()
+    http = TimedHttpSession(clock, latency=http_latency)
+    model = TimedGeminiModel(clock, gemini_latency, price_model)
+    limiter = RateLimiter(send_rate, clock=clock.clock, sleep=clock.sleep) if send_rate > 0 else None
+
+    workdir = tempfile.mkdtemp(prefix='pilates-simulate-')
+    try:
+        if state_dir:
+            for name in STATE_FILES:
+                if os.path.exists(os.path.join(state_dir, name)):
+                    shutil.copy(os.path.join(state_dir, name), workdir)
+        bot = whatsapp_pilates_bot.WhatsAppPilatesBot('simulate', 'simulate', config.BOT_NUMBER or '+10000000000',
+                                                      lazy=True, http=http, model=model, data_dir=workdir,
+                                                      rate_limiter=limiter)
+        bot.token_ledger.clock = clock.clock
+        if not state_dir:
+            synthetic_state(bot, groups, members, completion_rate)
+        bot.warm_up()
+        serve_known_groups(bot, http)
+        http.calls.clear()
+        http.log.clear()
+
+        phases = []
+
+        def phase(name, method):
+            def timed(*args, **kwargs):
+                started = clock.now
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    phases.append({'phase': name, 'start_seconds': round(started, 3),
+                                   'seconds': round(clock.now - started, 3)})
+            return timed
+
+        for name in ('refresh_participants', 'run_group_reports', 'archive_week_history'):
+            setattr(bot, name, phase(name, getattr(bot, name)))
+
+        tracked = {uuid: len(progress.participants.numbers_in(
+                       progress.participants.members & ~progress.participants.bit(bot.bot_number)))
+                   for uuid, progress in bot.weekly_progress.items()}
+        bot.saturday_report()
+
+        sends = [t for t, endpoint in http.log if endpoint == 'send_message']
+        requests_2chat = [t for t, _ in http.log]
+        return {
+            'groups': len(tracked),
+            'members': sum(tracked.values()),
+            'virtual_seconds': round(clock.now, 3),
+            'phases': phases,
+            'reminded': len(bot.auto_reply_members),
+            'twochat_calls': dict(http.calls),
+            'peak_requests': {'per_second': peak_rate(requests_2chat, 1.0),
+                              'per_minute': peak_rate(requests_2chat, 60.0)},
+            'rate_limit': {
+                **violations(sends, api_limit),
+                'send_rate_limiter': send_rate or None,
+                'throttled_sends': limiter.throttled if limiter else 0,
+                'throttled_seconds': round(limiter.waited, 3) if limiter else 0.0,
+            },
+            'gemini_calls': model.calls,
+            'gemini_tokens': bot.token_ledger.snapshot(),
+            'timeline': timeline(http.log, model.log, bucket),
+            'workdir': workdir if keep else None,
+        }
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry-run the Saturday report offline on a virtual clock")
+    parser.add_argument('--state-dir', default='', help="directory with state JSON files to copy (default: synthetic)")
+    parser.add_argument('--groups', type=int, default=100, help="synthetic groups")
+    parser.add_argument('--members', type=int, default=30, help="synthetic members per group")
+    parser.add_argument('--completion-rate', type=float, default=0.3, help="synthetic share of members who completed")
+    parser.add_argument('--http-latency', type=float, default=0.15, help="seconds per 2Chat call")
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help="seconds per Gemini call")
+    parser.add_argument('--send-rate', type=float, default=0.0, help="send limiter rate per second (0 = none, as in production)")
+    parser.add_argument('--api-limit', type=int, default=5, help="2Chat sends per second counted as a violation above")
+    parser.add_argument('--bucket', type=float, default=60.0, help="timeline bucket in seconds")
+    parser.add_argument('--price-model', default='gemini-2.5-flash', help="GEMINI_PRICES entry used for cost")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary state directory")
+    parser.add_argument('--report', default='', help="also write the report as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report = simulate(args.state_dir, args.groups, args.members, args.completion_rate, args.http_latency,
+                      args.gemini_latency, args.send_rate, args.api_limit, args.bucket, args.price_model, args.keep)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
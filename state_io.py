@@ -0,0 +1,167 @@
+# Crash-safe JSON state files: atomic replace, checksummed header, previous generation
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 'pilates-state'
+VERSION = 1
+PREVIOUS_SUFFIX = '.1'  # last good generation, kept next to the current file
+CHUNK_SIZE = 1 << 20
+
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
+
+class StateFileError(ValueError):
+    """A state file failed verification (bad checksum, truncated, unknown version)"""
+
+
+def _lock_for(path: str) -> threading.Lock:
+    path = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.Lock()
+        return lock
+
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # not supported on this platform
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_text(path: str, body: str):
+    """Atomically replace path with body under a checksummed header.
+
+    The body goes to a temp file in the same directory, is fsynced and renamed
+    over the target; the file it replaces is kept as path + '.1'. A crash at any
+    point leaves either the old or the new generation readable.
+    """
+    data = body.encode('utf-8')
+    header = json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'bytes': len(data),
+        'written_at': round(time.time(), 3),
+    }, separators=(',', ':')).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with _lock_for(path):
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header + b'\n')
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.replace(path, path + PREVIOUS_SUFFIX)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        _fsync_dir(directory)
+
+
+def write_state(path: str, data: Any, indent: Optional[int] = 2):
+    """Serialise data as JSON and write it with write_text"""
+    write_text(path, json.dumps(data, indent=indent, ensure_ascii=False))
+
+
+def _read_one(path: str) -> Tuple[Any, bool, int]:
+    """(data, legacy, size) of one file, verifying the checksum while reading"""
+    with open(path, 'rb') as f:
+        first = f.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+
+        if not (isinstance(header, dict) and header.get('format') == FORMAT):
+            # Written before headers existed: the whole file is the JSON document
+            body = first + f.read()
+            try:
+                return json.loads(body), True, len(body)
+            except ValueError as e:
+                raise StateFileError(f"invalid JSON: {e}") from e
+
+        if header.get('version', 0) > VERSION:
+            raise StateFileError(f"written by a newer version ({header.get('version')})")
+
+        digest = hashlib.sha256()
+        chunks = []
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            chunks.append(chunk)
+        body = b''.join(chunks)
+
+    if len(body) != header.get('bytes'):
+        raise StateFileError(f"truncated ({len(body)} of {header.get('bytes')} bytes)")
+    if digest.hexdigest() != header.get('sha256'):
+        raise StateFileError("checksum mismatch")
+    try:
+        return json.loads(body), False, len(body)
+    except ValueError as e:
+        raise StateFileError(f"invalid JSON: {e}") from e
+
+
+def load_state(path: str) -> Tuple[Any, Dict]:
+    """Load path, falling back to its previous generation if it fails verification.
+
+    Returns (data, info); data is None when neither generation exists or is
+    readable. A current file that fails verification is renamed to
+    path + '.corrupt-<time>' so the next write does not rotate it over the
+    good previous generation.
+    """
+    started = time.perf_counter()
+    for generation, candidate in enumerate((path, path + PREVIOUS_SUFFIX)):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            data, legacy, size = _read_one(candidate)
+        except (OSError, StateFileError) as e:
+            logger.error(f"State file {candidate} failed verification: {e}")
+            if generation == 0:
+                quarantined = f"{path}.corrupt-{int(time.time())}"
+                try:
+                    with _lock_for(path):
+                        os.replace(path, quarantined)
+                    logger.error(f"Moved {path} aside to {quarantined}")
+                except OSError:
+                    pass
+            continue
+
+        if generation:
+            logger.warning(f"Recovered {path} from previous generation {candidate}")
+        return data, {
+            'file': candidate,
+            'generation': generation,
+            'legacy': legacy,
+            'bytes': size,
+            'seconds': round(time.perf_counter() - started, 6),
+        }
+    return None, {'file': None, 'seconds': round(time.perf_counter() - started, 6)}
@@ -0,0 +1,107 @@
+# Hosting several bot numbers (tenants) in one process
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from keyed_executor import KeyedExecutor
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_number(phone_number: str) -> str:
+    """Digits only, so '+353 87 ...' and '35387...' route to the same tenant"""
+    return re.sub(r'\D', '', phone_number or '')
+
+
+class TenantRegistry:
+    """One WhatsAppPilatesBot per bot number, sharing the HTTP pool and Gemini model.
+
+    Each tenant keeps its own state files under `data_root/<number>/` and its
+    own outbound send rate limit; webhooks are routed by channel_phone_number.
+    """
+
+    def __init__(self, bot_class, model, data_root: str = 'tenants', lazy: bool = False, pool_size: int = 32):
+        # bot_class/model are passed in (WhatsAppPilatesBot, LazyGeminiModel) so this
+        # module does not import the bot module, which usually runs as __main__
+        self.bot_class = bot_class
+        self.model = model
+        self.data_root = data_root
+        self.lazy = lazy
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        # One auto-reply executor for all tenants, keyed by (bot number, sender)
+        self.private_executor = KeyedExecutor(window=config.AUTO_REPLY_COALESCE_SECONDS,
+                                              max_workers=config.AUTO_REPLY_WORKERS)
+        self._tenants: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def add(self, bot_number: str, api_key: str, send_rate_per_second: float = 0.0) -> object:
+        """Create and register the bot for one tenant number"""
+        key = normalize_number(bot_number)
+        if not key:
+            raise ValueError("Tenant bot_number is required")
+        rate_limiter = RateLimiter(send_rate_per_second) if send_rate_per_second > 0 else None
+        bot = self.bot_class(
+            api_key=api_key,
+            gemini_api_key='',
+            bot_number=bot_number,
+            lazy=self.lazy,
+            http=self.http,
+            model=self.model,
+            data_dir=os.path.join(self.data_root, key),
+            rate_limiter=rate_limiter,
+            private_executor=self.private_executor
+        )
+        with self._lock:
+            if key in self._tenants:
+                raise ValueError(f"Tenant {bot_number} registered twice")
+            self._tenants[key] = bot
+        logger.info(f"Registered tenant {bot_number}")
+        return bot
+
+    def get(self, channel_phone_number: str) -> Optional[object]:
+        return self._tenants.get(normalize_number(channel_phone_number))
+
+    def bots(self) -> List[object]:
+        return list(self._tenants.values())
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    def start_scheduler(self):
+        """Run every tenant's weekly jobs from a single scheduler loop"""
+        import schedule
+
+        for bot in self.bots():
+            bot.schedule_jobs(schedule)
+        while True:
+            schedule.run_pending()
+            time.sleep(60)
+
+    @classmethod
+    def from_file(cls, path: str, bot_class, model, lazy: bool = False) -> 'TenantRegistry':
+        """Build a registry from a JSON list of {"bot_number", "api_key", "send_rate_per_second"}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            tenants = json.load(f)
+
+        data_root = os.path.join(os.path.dirname(os.path.abspath(path)), 'tenants')
+        registry = cls(bot_class, model, data_root=data_root, lazy=lazy)
+        for tenant in tenants:
+            registry.add(
+                tenant['bot_number'],
+                tenant['api_key'],
+                float(tenant.get('send_rate_per_second', 0))
+            )
+        return registry
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-request tracing: spans, correlation ids and batch exporters.
+
+Spans are only recorded once an exporter is configured; until then span()
+returns a shared no-op object. The correlation id (X-Request-ID) lives in a
+context variable and is set for every request either way.
+
+Running this file starts a minimal OTLP/HTTP JSON collector stand-in that
+appends received spans to a JSON-lines file:
+
+    python tracing.py --port 4318 --out spans.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+correlation_id: ContextVar[str] = ContextVar('correlation_id', default='')
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+_exporter: Optional['BatchExporter'] = None
+
+SAFE_CORRELATION_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+HEX_TRACE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def configure(exporter: Optional['BatchExporter']):
+    """Install (or with None, remove) the exporter that receives finished spans"""
+    global _exporter
+    _exporter = exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def stats() -> Dict:
+    exporter = _exporter
+    if exporter is None:
+        return {'enabled': False}
+    return {'enabled': True, 'exporter': type(exporter).__name__, **exporter.stats()}
+
+
+def flush(timeout: float = 5.0) -> bool:
+    exporter = _exporter
+    return exporter.flush(timeout) if exporter is not None else True
+
+
+def new_correlation_id(incoming: str = '') -> str:
+    """Use the caller's X-Request-ID when it is sane, otherwise mint one"""
+    if incoming and SAFE_CORRELATION_ID.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def trace_id_of(correlation: str) -> str:
+    """OTLP trace id (32 hex chars) for a correlation id"""
+    if HEX_TRACE_ID.match(correlation):
+        return correlation
+    return hashlib.md5(correlation.encode('utf-8')).hexdigest()
+
+
+class Span:
+    __slots__ = ('name', 'correlation_id', 'span_id', 'parent_id', 'start_ns', 'attributes', 'error', '_token')
+
+    def __init__(self, name: str, attributes: Dict):
+        parent = _current_span.get()
+        self.name = name
+        self.correlation_id = correlation_id.get() or (parent.correlation_id if parent else '')
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ''
+        self.attributes = attributes
+        self.error = ''
+        self.start_ns = time.time_ns()
+        self._token = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export({
+                'name': self.name,
+                'correlation_id': self.correlation_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start_ns': self.start_ns,
+                'end_ns': end_ns,
+                'duration_ms': round((end_ns - self.start_ns) / 1e6, 3),
+                'attributes': self.attributes,
+                'error': self.error,
+            })
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Context manager timing one pipeline stage under the current span"""
+    if _exporter is None:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+class BatchExporter:
+    """Queues finished spans and writes them in batches from a background thread.
+
+    Spans are dropped (and counted) rather than blocking the request when the
+    queue is full.
+    """
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 512, interval: float = 1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def export(self, record: Dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            batch, flushed = [], []
+            item = first
+            while True:
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.write(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    logger.error(f"Error exporting {len(batch)} spans: {e}")
+            for event in flushed:
+                event.set()
+
+    def write(self, batch: List[Dict]):
+        raise NotImplementedError
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far has been written"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stats(self) -> Dict:
+        return {'exported': self.exported, 'dropped': self.dropped, 'failed': self.failed,
+                'queued': self._queue.qsize()}
+
+
+class JsonlFileExporter(BatchExporter):
+    """Appends one JSON object per span to a local file"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def write(self, batch: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in batch:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(batch: List[Dict], service_name: str) -> Dict:
+    """OTLP/HTTP JSON ExportTraceServiceRequest for a batch of span records"""
+    spans = []
+    for record in batch:
+        attributes = {**record['attributes'], 'correlation_id': record['correlation_id']}
+        span = {
+            'traceId': trace_id_of(record['correlation_id'] or record['span_id']),
+            'spanId': record['span_id'],
+            'name': record['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(record['start_ns']),
+            'endTimeUnixNano': str(record['end_ns']),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()],
+            'status': {'code': 2, 'message': record['error']} if record['error'] else {'code': 1},
+        }
+        if record['parent_id']:
+            span['parentSpanId'] = record['parent_id']
+        spans.append(span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{'scope': {'name': 'whatsapp_pilates_bot'}, 'spans': spans}],
+    }]}
+
+
+class OtlpHttpExporter(BatchExporter):
+    """Posts batches as OTLP/HTTP JSON, e.g. to http://localhost:4318/v1/traces"""
+
+    def __init__(self, endpoint: str, service_name: str = 'whatsapp-pilates-bot', timeout: float = 5.0, **kwargs):
+        import requests
+
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self.http = requests.Session()
+        super().__init__(**kwargs)
+
+    def write(self, batch: List[Dict]):
+        response = self.http.post(self.endpoint, json=otlp_payload(batch, self.service_name), timeout=self.timeout)
+        if response.status_code >= 300:
+            raise RuntimeError(f"collector returned {response.status_code}")
+
+
+def exporter_from_config(config) -> Optional[BatchExporter]:
+    if config.TRACE_EXPORT == 'file':
+        return JsonlFileExporter(config.TRACE_FILE)
+    if config.TRACE_EXPORT == 'otlp':
+        return OtlpHttpExporter(config.TRACE_OTLP_ENDPOINT)
+    if config.TRACE_EXPORT:
+        logger.warning(f"Unknown TRACE_EXPORT '{config.TRACE_EXPORT}', tracing disabled")
+    return None
+
+
+def serve_collector(port: int, out: str):
+    """Accept OTLP/HTTP JSON trace exports and append the spans to a JSON-lines file"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                lines = []
+                for resource in body.get('resourceSpans', []):
+                    for scope in resource.get('scopeSpans', []):
+                        for span in scope.get('spans', []):
+                            lines.append(json.dumps(span, ensure_ascii=False))
+                with lock, open(out, 'a', encoding='utf-8') as f:
+                    f.writelines(line + '\n' for line in lines)
+                self.send_response(200)
+            except Exception as e:
+                logger.error(f"Bad export: {e}")
+                self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    print(f"Collecting spans on http://0.0.0.0:{port}/v1/traces into {out}")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal OTLP/HTTP JSON trace collector")
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--out', default='spans.jsonl')
+    args = parser.parse_args()
+    serve_collector(args.port, args.out)
+
+
+if __name__ == "__main__":
+    main()
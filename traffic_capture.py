@@ -0,0 +1,193 @@
+# Opt-in capture of inbound webhook traffic to a gzip'd JSON-lines file
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, Optional
+
+from webhook_events import WebhookDecodeError, loads
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_FORMAT_VERSION = 1
+
+# Payload keys holding personal data, replaced by stable pseudonyms
+PHONE_KEYS = {'phone_number', 'remote_phone_number', 'channel_phone_number', 'on_number'}
+NAME_KEYS = {'pushname', 'first_name', 'last_name', 'friendly_name', 'profile_pic_url'}
+
+
+def load_or_create_salt(path: str) -> str:
+    """Salt stored at path, created (random, owner-only) on first use.
+
+    Pseudonyms are only as strong as the key: phone numbers are a small space,
+    so with an empty or guessable key they can be reversed by brute force.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            salt = f.read().strip()
+        if salt:
+            return salt
+    except FileNotFoundError:
+        pass
+    salt = secrets.token_hex(32)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(salt + '\n')
+    logger.info(f"Generated capture salt in {path}; keep it private")
+    return salt
+
+
+def gzip_complete(path: str) -> bool:
+    """True if every gzip member of path is terminated (readable to the end)"""
+    try:
+        with gzip.open(path, 'rb') as f:
+            while f.read(1 << 20):
+                pass
+        return True
+    except (EOFError, OSError, zlib.error):
+        return False
+
+
+class Redactor:
+    """Pseudonymise phone numbers and names with a keyed hash.
+
+    The same number always maps to the same pseudonym within one salt, so
+    replayed traffic still lines up with group membership and the bot number.
+    """
+
+    def __init__(self, salt: str, redact_text: bool = False):
+        if not salt:
+            raise ValueError("A non-empty salt is required to pseudonymise captures")
+        self.key = salt.encode('utf-8')
+        self.redact_text = redact_text
+
+    def _digest(self, value: str) -> str:
+        return hmac.new(self.key, value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def phone(self, value: str) -> str:
+        if not value:
+            return value
+        # Keep it shaped like a phone number so downstream code treats it as one
+        return '+' + str(int(self._digest(value)[:12], 16)).zfill(15)[:12]
+
+    def name(self, value: str) -> str:
+        return f"member-{self._digest(value)[:8]}" if value else value
+
+    def payload(self, data):
+        if isinstance(data, dict):
+            redacted = {}
+            for key, value in data.items():
+                if key in PHONE_KEYS and isinstance(value, str):
+                    redacted[key] = self.phone(value)
+                elif key in NAME_KEYS and isinstance(value, str):
+                    redacted[key] = self.name(value)
+                elif key == 'text' and self.redact_text and isinstance(value, str):
+                    redacted[key] = f"<{len(value)} chars>"
+                else:
+                    redacted[key] = self.payload(value)
+            return redacted
+        if isinstance(data, list):
+            return [self.payload(item) for item in data]
+        return data
+
+
+class TrafficRecorder:
+    """Append redacted webhook payloads to a capture file from a background thread.
+
+    Each line is {"t": arrival epoch seconds, "route": ..., "payload": ...}; the
+    first line of a new file is a header carrying the redacted bot number.
+    close() must be called on shutdown, otherwise the gzip stream is left
+    without its end marker.
+    """
+
+    def __init__(self, path: str, bot_number: str = '', salt: str = '', redact_text: bool = False,
+                 max_pending: int = 10000):
+        self.path = path
+        self.redactor = Redactor(salt, redact_text)
+        self.bot_number = bot_number
+        self.recorded = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._writer, name='traffic-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, route: str, raw: bytes):
+        """Queue a raw webhook body; never blocks the request thread"""
+        try:
+            self._queue.put_nowait((time.time(), route, raw))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 10.0):
+        """Write what is queued and terminate the gzip stream"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _set_aside_unclosed(self):
+        """Move a capture that was never closed out of the way so a new file starts at self.path"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0 or gzip_complete(self.path):
+            return
+        # Appending after an unterminated member would make the whole file unreadable
+        if self.path.endswith('.jsonl.gz'):
+            root, ext = self.path[:-len('.jsonl.gz')], '.jsonl.gz'
+        else:
+            root, ext = os.path.splitext(self.path)
+        aside = f"{root}-unclosed-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        os.replace(self.path, aside)
+        logger.warning(f"Capture {self.path} was not closed cleanly, moved it to {aside}")
+
+    def _writer(self):
+        self._set_aside_unclosed()
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        # gzip members can be concatenated, so appending keeps earlier captures readable
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            if new_file:
+                f.write(json.dumps({
+                    'capture_version': CAPTURE_FORMAT_VERSION,
+                    'bot_number': self.redactor.phone(self.bot_number),
+                }) + '\n')
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                arrived, route, raw = item
+                try:
+                    payload = self.redactor.payload(loads(raw))
+                except WebhookDecodeError:
+                    self.dropped += 1
+                    continue
+                f.write(json.dumps({'t': arrived, 'route': route, 'payload': payload}, ensure_ascii=False) + '\n')
+                self.recorded += 1
+                if self._queue.empty():
+                    f.flush()
+
+
+def read_capture(path: str) -> Iterator[Dict]:
+    """Yield header and records from a capture file, in file order"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            # Written by a process that was killed before close(); keep what was readable
+            logger.warning(f"Capture {path} ends early ({e}); records after that point are lost")
+
+
+def capture_header(path: str) -> Optional[Dict]:
+    for record in read_capture(path):
+        return record if 'capture_version' in record else None
+    return None
@@ -0,0 +1,153 @@
+# Fast-path decoding of 2Chat webhook payloads into slim event objects
+
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import config
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+PILATES_KEYWORD_BYTES = config.PILATES_KEYWORD.lower().encode('utf-8')
+
+
+class WebhookDecodeError(ValueError):
+    """Payload is not valid JSON or lacks a field the bot relies on"""
+
+
+class IgnoredEvent(WebhookDecodeError):
+    """Payload is well-formed but not an event the bot handles"""
+
+
+@dataclass(slots=True)
+class GroupMessageEvent:
+    message_id: str
+    sent_by: str
+    text: str
+    from_number: str
+    sender_name: str
+    group_uuid: str
+    group_name: str
+    group_created_at: str
+    channel_phone_number: str
+    created_at: Optional[datetime]  # Timezone-aware, parsed once at decode time
+
+
+@dataclass(slots=True)
+class PrivateMessageEvent:
+    message_id: str
+    sent_by: str
+    text: str
+    from_number: str
+    sender_name: str
+    channel_phone_number: str
+
+
+def loads(raw: bytes):
+    """Parse JSON with orjson when installed, the json module otherwise"""
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    except ValueError as e:
+        raise WebhookDecodeError(f"Invalid JSON: {e}") from None
+
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """Parse a 2Chat ISO timestamp ('2025-08-15T07:56:11', optionally with Z/offset) as UTC-aware"""
+    if not value:
+        return None
+    try:
+        # fromisoformat only accepts a trailing Z from Python 3.11
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _str(data: Dict, key: str) -> str:
+    value = data.get(key)
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise WebhookDecodeError(f"Field '{key}' must be a string")
+
+
+def _obj(data: Dict, key: str) -> Dict:
+    value = data.get(key)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise WebhookDecodeError(f"Field '{key}' must be an object")
+    return value
+
+
+def group_event_from_dict(data: Dict) -> GroupMessageEvent:
+    """Validate the fields used for completion tracking and build a GroupMessageEvent"""
+    if not isinstance(data, dict):
+        raise WebhookDecodeError("Webhook payload must be a JSON object")
+
+    group = _obj(data, 'group')
+    group_uuid = _str(group, 'uuid')
+    if not group_uuid:
+        raise IgnoredEvent("Non-group message")
+
+    group_name = _str(group, 'wa_group_name')
+    if config.PILATES_KEYWORD.lower() not in group_name.lower():
+        raise IgnoredEvent(f"Message not from a pilates group: {group_name}")
+
+    participant = _obj(data, 'participant')
+    return GroupMessageEvent(
+        message_id=_str(data, 'id'),
+        sent_by=_str(data, 'sent_by'),
+        text=_str(_obj(data, 'message'), 'text'),
+        from_number=_str(participant, 'phone_number'),
+        sender_name=_str(participant, 'pushname'),
+        group_uuid=group_uuid,
+        group_name=group_name,
+        group_created_at=_str(group, 'wa_created_at'),
+        channel_phone_number=_str(data, 'channel_phone_number'),
+        created_at=parse_timestamp(_str(data, 'created_at')),
+    )
+
+
+def private_event_from_dict(data: Dict) -> PrivateMessageEvent:
+    """Validate the fields used for auto-replies and build a PrivateMessageEvent"""
+    if not isinstance(data, dict):
+        raise WebhookDecodeError("Webhook payload must be a JSON object")
+
+    contact = _obj(data, 'contact')
+    sender_name = _str(contact, 'first_name') or _str(contact, 'last_name') or _str(contact, 'friendly_name')
+    return PrivateMessageEvent(
+        message_id=_str(data, 'id'),
+        sent_by=_str(data, 'sent_by'),
+        text=_str(_obj(data, 'message'), 'text'),
+        from_number=_str(data, 'remote_phone_number'),
+        sender_name=sender_name,
+        channel_phone_number=_str(data, 'channel_phone_number'),
+    )
+
+
+def decode_group_message(raw: bytes) -> GroupMessageEvent:
+    """Decode a raw group webhook body.
+
+    Bodies that do not contain the pilates keyword anywhere cannot belong to a
+    pilates group and are rejected before the JSON is parsed.
+    """
+    if PILATES_KEYWORD_BYTES not in raw.lower():
+        raise IgnoredEvent("Message not from a pilates group")
+    return group_event_from_dict(loads(raw))
+
+
+def decode_private_message(raw: bytes) -> PrivateMessageEvent:
+    """Decode a raw private chat webhook body"""
+    return private_event_from_dict(loads(raw))
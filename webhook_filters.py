@@ -0,0 +1,39 @@
+# Cheap, ordered reject stages for inbound webhook events
+
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FilterPipeline:
+    """Run reject predicates in order and count which stage dropped each event.
+
+    Stages are (name, predicate) pairs; a predicate returns True when the event
+    should be dropped. Order stages from cheapest to most expensive so most
+    traffic never reaches the costly checks.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable]]):
+        self.stages = stages
+        self._lock = threading.Lock()
+        self.drops: Dict[str, int] = {name: 0 for name, _ in stages}
+        self.passed = 0
+
+    def admit(self, event) -> bool:
+        """Return True if the event passed every stage"""
+        for name, rejects in self.stages:
+            if rejects(event):
+                with self._lock:
+                    self.drops[name] += 1
+                logger.debug(f"Dropped event at stage '{name}'")
+                return False
+        with self._lock:
+            self.passed += 1
+        return True
+
+    def stats(self) -> Dict:
+        """Per-stage drop counters and the number of events that passed"""
+        with self._lock:
+            return {'drops': dict(self.drops), 'passed': self.passed}
@@ -1,64 +1,331 @@
+import time
+
+# Taken before any third-party import so the startup metric includes import cost
+STARTUP_T0 = time.monotonic()
+
 import requests
 import json
-import schedule
-import time
-import google.generativeai as genai
 from datetime import datetime, timedelta
 import pytz
-from typing import List, Dict, Set
+from typing import Callable, List, Dict, Set, Iterable, Optional, Tuple
 import logging
 import os
+import re
+import sys
+import queue
+import signal
+import socket
 from dataclasses import dataclass
 import config
-from flask import Flask, request
-from pyngrok import ngrok
 import threading
+import contextvars
+import functools
+import hmac
+from urllib.parse import urlsplit
+from webhook_events import (
+    GroupMessageEvent,
+    IgnoredEvent,
+    PrivateMessageEvent,
+    WebhookDecodeError,
+    decode_group_message,
+    decode_private_message,
+    group_event_from_dict,
+    private_event_from_dict,
+    parse_timestamp,
+    PILATES_KEYWORD_BYTES,
+)
+from webhook_filters import FilterPipeline
+from traffic_capture import TrafficRecorder, load_or_create_salt
+from history_store import HistoryStore
+from keyed_executor import KeyedExecutor
+from state_io import load_state, write_state, write_text
+from persistence import PersistenceScheduler
+from metrics import LatencyRecorder
+from prompts import TokenLedger, compile_prompts, usage_of
+from admission import LaneFull, admission_from_config
+from sharding import message_text_of
+import tracing
+import profiler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-@dataclass
+class ParticipantIndex:
+    """Append-only index of the phone numbers seen in one group.
+
+    Each number gets a stable bit position the first time it is seen, and
+    `members` is the bitmap of current participants. Membership and completion
+    sets are plain ints over this index, so set algebra is bitwise.
+    """
+    __slots__ = ('numbers', 'positions', 'members')
+
+    def __init__(self, numbers: Iterable[str] = ()):
+        self.numbers: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.members = 0
+        for phone_number in numbers:
+            self.add(phone_number)
+
+    def position(self, phone_number: str) -> int:
+        """Bit position of a number, assigning a new one if it was never seen"""
+        pos = self.positions.get(phone_number)
+        if pos is None:
+            phone_number = sys.intern(phone_number)
+            pos = len(self.numbers)
+            self.numbers.append(phone_number)
+            self.positions[phone_number] = pos
+        return pos
+
+    def bit(self, phone_number: str) -> int:
+        """Bit of a known number, 0 for unknown numbers"""
+        pos = self.positions.get(phone_number)
+        return 0 if pos is None else 1 << pos
+
+    def mask_of(self, numbers: Iterable[str]) -> int:
+        """Bitmap of the given numbers, indexing unseen ones"""
+        mask = 0
+        for phone_number in numbers:
+            mask |= 1 << self.position(phone_number)
+        return mask
+
+    def numbers_in(self, mask: int) -> List[str]:
+        """Phone numbers whose bits are set in mask"""
+        result = []
+        while mask:
+            low = mask & -mask
+            result.append(self.numbers[low.bit_length() - 1])
+            mask ^= low
+        return result
+
+    def add(self, phone_number: str):
+        self.members |= 1 << self.position(phone_number)
+
+    def discard(self, phone_number: str):
+        self.members &= ~self.bit(phone_number)
+
+    def sync(self, numbers: Iterable[str]) -> Tuple[int, int]:
+        """Replace current membership, returning (joined_mask, left_mask)"""
+        new_members = self.mask_of(numbers)
+        joined = new_members & ~self.members
+        left = self.members & ~new_members
+        self.members = new_members
+        return joined, left
+
+    def __contains__(self, phone_number: str) -> bool:
+        return bool(self.members & self.bit(phone_number))
+
+    def __iter__(self):
+        return iter(self.numbers_in(self.members))
+
+    def __len__(self) -> int:
+        return self.members.bit_count()
+
+    def __repr__(self) -> str:
+        return f"ParticipantIndex(members={len(self)}, indexed={len(self.numbers)})"
+
+@dataclass(slots=True)
 class GroupInfo:
     uuid: str
     name: str
-    participants: List[Dict]
+    participants: ParticipantIndex
     created_at: str = ""
 
-@dataclass
+@dataclass(slots=True)
 class WeeklyProgress:
     group_uuid: str
     week_start: str
-    completed_members: Set[str]  # Set of phone numbers for backward compatibility
+    participants: ParticipantIndex  # Shared with the group's GroupInfo
+    completed_mask: int  # Bitmap over participants of members who completed
     completed_members_info: Dict[str, str]  # Dict mapping phone_number -> pushname
     messages_analyzed: Set[str]
 
-@dataclass
+    @property
+    def completed_members(self) -> Set[str]:
+        """Set of phone numbers that completed this week"""
+        return set(self.participants.numbers_in(self.completed_mask))
+
+    def is_completed(self, phone_number: str) -> bool:
+        return bool(self.completed_mask & self.participants.bit(phone_number))
+
+    def mark_completed(self, phone_number: str):
+        self.completed_mask |= 1 << self.participants.position(phone_number)
+
+    def reset(self, week_start: str):
+        self.week_start = week_start
+        self.completed_mask = 0
+        self.completed_members_info.clear()
+        self.messages_analyzed.clear()
+
+@dataclass(slots=True)
 class AutoReplyMember:
     phone_number: str
     group_uuid: str
     message_sent: str
     created_at: str
 
+@dataclass(slots=True)
+class MembershipChange:
+    group_uuid: str
+    phone_number: str
+    kind: str  # 'joined' or 'left'
+
+class LazyGeminiModel:
+    """Gemini model configured and constructed on first use; can be shared between bots"""
+
+    def __init__(self, api_key: str, model_name: str = 'gemini-2.5-flash'):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._variants: Dict[str, 'LazyGeminiModel'] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate_content(self, *args, **kwargs):
+        return self.load().generate_content(*args, **kwargs)
+
+    def variant(self, model_name: str) -> 'LazyGeminiModel':
+        """Sibling model with the same key, e.g. a cheaper one for classification"""
+        if model_name == self.model_name:
+            return self
+        with self._lock:
+            if model_name not in self._variants:
+                self._variants[model_name] = LazyGeminiModel(self.api_key, model_name)
+            return self._variants[model_name]
+
+# First sentence of a partially streamed reply, once the next one has started
+FIRST_SENTENCE = re.compile(r'^(.+?[.!?])\s+(?=\S)', re.DOTALL)
+
+class PipelinedReply:
+    """Outbound messages of one auto reply, sent in order off the generating thread.
+
+    The first message to go out (quick acknowledgement, opening sentence or the
+    whole reply) is recorded as the time to first response, counted from
+    started (a time.perf_counter() value).
+    """
+
+    def __init__(self, send: Callable[[str], bool], started: float, first_response: LatencyRecorder):
+        self._send = send
+        self._started = started
+        self._first_response = first_response
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        # Run in a copy of the caller's context so sends stay in the request's trace
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,),
+                                        name='reply-sender', daemon=True)
+        self._thread.start()
+
+    def put(self, text: str):
+        with self._lock:
+            self.queued += 1
+            self._queue.put(text)
+
+    def put_if_first(self, text: str):
+        """Queue text only if nothing has been queued yet (used for the quick ack)"""
+        with self._lock:
+            if self.queued:
+                return
+            self.queued += 1
+            self._queue.put(text)
+
+    def _run(self):
+        while True:
+            text = self._queue.get()
+            if text is None:
+                return
+            if self._send(text):
+                if not self.sent:
+                    self._first_response.record(time.perf_counter() - self._started)
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def close(self) -> bool:
+        """Wait for everything queued to be sent; True if every send succeeded"""
+        self._queue.put(None)
+        self._thread.join()
+        return self.failed == 0
+
+class WeekClock:
+    """Current Monday-based week in a timezone, recomputed only at rollover"""
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.week_start = ''
+        self.week_start_date: datetime = None
+        self._next_rollover = 0.0
+
+    def current(self) -> Tuple[str, datetime]:
+        """Return (week_start 'YYYY-MM-DD', aware Monday 00:00)"""
+        if time.time() >= self._next_rollover:
+            now = datetime.now(self.tz)
+            monday = datetime(now.year, now.month, now.day) - timedelta(days=now.weekday())
+            self.week_start_date = self.tz.localize(monday)
+            self.week_start = monday.strftime('%Y-%m-%d')
+            self._next_rollover = self.tz.localize(monday + timedelta(days=7)).timestamp()
+        return self.week_start, self.week_start_date
+
 class WhatsAppPilatesBot:
-    def __init__(self, api_key: str, gemini_api_key: str, bot_number: str):
+    def __init__(self, api_key: str, gemini_api_key: str, bot_number: str, lazy: bool = False,
+                 http=None, model=None, data_dir: str = '', rate_limiter=None, private_executor=None):
         self.api_key = api_key
         self.bot_number = bot_number
         self.base_url = "https://api.p.2chat.io/open/whatsapp"
         
-        # Initialize Gemini AI
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # HTTP session for all 2Chat calls (pooled connections, replaceable by stubs)
+        self.http = http or requests.Session()
+        
+        # Gemini AI model, built on first use unless a (shared) model is passed in
+        self.model = model or LazyGeminiModel(gemini_api_key)
+        
+        # Compiled prompts, optional cheaper classifier model and token/cost totals
+        self.prompts = compile_prompts()
+        self.classifier_model = self.model.variant(config.GEMINI_CLASSIFIER_MODEL) if config.GEMINI_CLASSIFIER_MODEL else self.model
+        self.classifier_prompt = self.prompts['completion_short' if config.GEMINI_SHORT_CLASSIFIER_PROMPT else 'completion']
+        self.token_ledger = TokenLedger(config.GEMINI_PRICES)
+        
+        # Optional limiter for outbound 2Chat sends (per tenant when multi-tenant)
+        self.rate_limiter = rate_limiter
         
         # Ireland timezone
         self.ireland_tz = pytz.timezone(config.IRELAND_TIMEZONE)
         
         # Weekly progress tracking
+        self._groups_by_uuid: Dict[str, GroupInfo] = {}
         self.available_groups: List[GroupInfo] = []
         self.weekly_progress: Dict[str, WeeklyProgress] = {}
         
-        # Auto reply members tracking
+        # Participant indexes by group uuid, shared by GroupInfo and WeeklyProgress
+        # so their bitmaps always refer to the same bit positions
+        self._participant_indexes: Dict[str, ParticipantIndex] = {}
+        
+        # Join/leave listeners, called with a MembershipChange for every participant change
+        self.membership_listeners: List[Callable[[MembershipChange], None]] = []
+        
+        # Serialized available_groups.json entry per group, rebuilt only for changed groups
+        self._group_fragments: Dict[str, str] = {}
+        
+        # Auto reply members tracking; replies run one batch at a time per sender
+        # (executor shared across tenants when passed in), removals under the lock
         self.auto_reply_members: List[AutoReplyMember] = []
+        self._auto_reply_lock = threading.Lock()
+        self.private_executor = private_executor or KeyedExecutor(
+            window=config.AUTO_REPLY_COALESCE_SECONDS,
+            max_workers=config.AUTO_REPLY_WORKERS
+        )
+        # Admission lanes of the web app (set by create_app); replies run in the 'private' lane
+        self.admission = None
         
         # Headers for API requests
         self.headers = {
@@ -66,61 +333,195 @@ class WhatsAppPilatesBot:
             'Content-Type': 'application/json'
         }
         
+        # Week boundary and per-group age verdicts, both cached until week rollover
+        self.week_clock = WeekClock(self.ireland_tz)
+        self._group_age_verdicts: Dict[str, Tuple[bool, float]] = {}
+        self._group_age_week = ''
+        
+        # Group webhook filters, cheapest first
+        self.group_filters = FilterPipeline([
+            ('not_user', lambda e: e.sent_by != 'user'),
+            ('from_bot', lambda e: e.from_number == self.bot_number or e.channel_phone_number == e.from_number),
+            ('no_text', lambda e: not e.text),
+            ('unknown_group', lambda e: e.group_uuid not in self._groups_by_uuid),
+            ('previous_week', self._is_from_previous_week),
+            ('group_too_new', lambda e: not self.is_group_old_enough_cached(e.group_uuid, e.group_created_at)),
+            ('already_analyzed', self._is_already_analyzed),
+            ('already_completed', self._is_already_completed),
+        ])
+        
         # File paths for data persistence
-        self.available_groups_file = 'available_groups.json'
-        self.weekly_progress_file = 'weekly_progress.json'
-        self.auto_reply_members_file = 'auto_reply_members.json'
+        self.data_dir = data_dir
+        self.available_groups_file = os.path.join(data_dir, 'available_groups.json')
+        self.weekly_progress_file = os.path.join(data_dir, 'weekly_progress.json')
+        self.auto_reply_members_file = os.path.join(data_dir, 'auto_reply_members.json')
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
         
-        # Load existing data on initialization
-        self.load_available_groups()
-        self.load_weekly_progress()
-        self.load_auto_reply_members()
+        # Completion history that survives the weekly reset
+        self.history = HistoryStore(os.path.join(data_dir, 'history'))
 
-        if self.available_groups == []:
-            self.find_pilates_groups()
+        # Whether warm-up may call find_pilates_groups (shard workers only read the groups file)
+        self.discover_groups = True
 
         # webhook uuids
         self.group_webhook_uuid = ""
         self.private_webhook_uuid = ""
+        
+        # Startup / runtime metrics exposed on /metrics
+        self.metrics: Dict[str, float] = {}
+        self.reply_latency = {
+            'first_token': LatencyRecorder(),
+            'first_response': LatencyRecorder(),
+            'total': LatencyRecorder(),
+        }
+        self._warm_lock = threading.Lock()
+        self._warm = threading.Event()
+        
+        # Hot-path saves are debounced onto a background flusher (0 = save inline)
+        self._progress_lock = threading.RLock()
+        self.persistence = PersistenceScheduler(config.PERSIST_INTERVAL_MS / 1000)
+        self.persistence.register('weekly_progress', self.save_weekly_progress)
+        self.persistence.register('auto_reply_members', self.save_auto_reply_members)
+        
+        # In lazy mode state loading and model construction are deferred to
+        # warm_up(), which main() runs in the background once Flask is listening
+        if not lazy:
+            self.warm_up()
     
-    def save_available_groups(self):
-        """Save available_groups to JSON file"""
+    def warm_up(self):
+        """Load persisted state, discover groups if needed and build the Gemini model"""
+        with self._warm_lock:
+            if self._warm.is_set():
+                return
+            
+            started = time.monotonic()
+            
+            # Load existing data
+            self.load_available_groups()
+            self.load_weekly_progress()
+            self.load_auto_reply_members()
+            self.history.load()
+
+            if self.available_groups == [] and self.discover_groups:
+                self.find_pilates_groups()
+            
+            try:
+                if isinstance(self.model, LazyGeminiModel):
+                    self.model.load()
+            except Exception as e:
+                logger.error(f"Error initializing Gemini model: {e}")
+            
+            self.metrics['warm_up_seconds'] = round(time.monotonic() - started, 3)
+            self._warm.set()
+            logger.info(f"Warm-up finished in {self.metrics['warm_up_seconds']}s")
+    
+    def ensure_warm(self):
+        """Block until state is loaded (no-op once warm-up has finished)"""
+        if not self._warm.is_set():
+            self.warm_up()
+    
+    def record_webhook_accepted(self):
+        """Record time from process start to the first accepted webhook"""
+        if 'first_webhook_seconds' not in self.metrics:
+            self.metrics['first_webhook_seconds'] = round(time.monotonic() - STARTUP_T0, 3)
+            logger.info(f"Startup: first webhook accepted {self.metrics['first_webhook_seconds']}s after process start")
+    
+    @property
+    def available_groups(self) -> List[GroupInfo]:
+        return self._available_groups
+    
+    @available_groups.setter
+    def available_groups(self, groups: List[GroupInfo]):
+        # Keep the uuid lookup in step with the list; always assign, never mutate in place
+        self._available_groups = groups
+        self._groups_by_uuid = {group.uuid: group for group in groups}
+    
+    def metrics_snapshot(self) -> Dict:
+        """Startup/runtime metrics plus filter pipeline counters"""
+        return {**self.metrics, 'group_filters': self.group_filters.stats(),
+                'private_replies': self.private_executor.stats(),
+                'auto_reply_latency': {name: recorder.summary() for name, recorder in self.reply_latency.items()},
+                'gemini': self.token_ledger.snapshot(),
+                'persistence': self.persistence.stats()}
+    
+    def participant_index(self, group_uuid: str) -> ParticipantIndex:
+        """Get (or create) the participant index of a group"""
+        index = self._participant_indexes.get(group_uuid)
+        if index is None:
+            index = self._participant_indexes[group_uuid] = ParticipantIndex()
+        return index
+    
+    def _group_fragment(self, group: GroupInfo) -> str:
+        """One group's entry in available_groups.json, indented as inside the list"""
+        fragment = json.dumps({
+            'uuid': group.uuid,
+            'name': group.name,
+            'participants': list(group.participants),
+            'created_at': group.created_at
+        }, indent=2, ensure_ascii=False)
+        return '  ' + fragment.replace('\n', '\n  ')
+    
+    def save_available_groups(self, changed: Iterable[str] = None):
+        """Save available_groups to JSON file, re-serializing only the changed groups if given"""
         try:
-            # Convert GroupInfo objects to dictionaries
-            groups_data = []
+            if changed is None:
+                self._group_fragments = {}
+            else:
+                for group_uuid in changed:
+                    self._group_fragments.pop(group_uuid, None)
+            
+            fragments = {}
             for group in self.available_groups:
-                groups_data.append({
-                    'uuid': group.uuid,
-                    'name': group.name,
-                    'participants': group.participants,
-                    'created_at': group.created_at
-                })
+                fragment = self._group_fragments.get(group.uuid)
+                if fragment is None:
+                    fragment = self._group_fragment(group)
+                fragments[group.uuid] = fragment
+            self._group_fragments = fragments
             
-            with open(self.available_groups_file, 'w', encoding='utf-8') as f:
-                json.dump(groups_data, f, indent=2, ensure_ascii=False)
+            # Same layout as json.dump(groups, indent=2)
+            with tracing.span('save', file='available_groups.json'):
+                write_text(self.available_groups_file,
+                           '[\n' + ',\n'.join(fragments.values()) + '\n]' if fragments else '[]')
             
-            logger.info(f"Saved {len(groups_data)} groups to {self.available_groups_file}")
+            logger.info(f"Saved {len(fragments)} groups to {self.available_groups_file}")
             
         except Exception as e:
             logger.error(f"Error saving available_groups: {e}")
     
+    def _load_state(self, path: str):
+        """Verified state file contents (or None), with load time and generation on /metrics"""
+        data, info = load_state(path)
+        self.metrics.setdefault('state_load', {})[os.path.basename(path)] = info
+        return data
+    
     def load_available_groups(self):
         """Load available_groups from JSON file"""
         try:
-            if os.path.exists(self.available_groups_file):
-                with open(self.available_groups_file, 'r', encoding='utf-8') as f:
-                    groups_data = json.load(f)
-                
+            groups_data = self._load_state(self.available_groups_file)
+            if groups_data is not None:
                 # Convert dictionaries back to GroupInfo objects
-                self.available_groups = []
+                groups = []
                 for group_dict in groups_data:
+                    group_uuid = group_dict.get('uuid', '')
+                    # Older files hold raw 2Chat participant dicts, newer ones plain numbers
+                    numbers = []
+                    for participant in group_dict.get('participants', []):
+                        if isinstance(participant, dict):
+                            participant = participant.get('phone_number', '')
+                        if participant:
+                            numbers.append(participant)
+                    index = self.participant_index(group_uuid)
+                    index.sync(numbers)
                     group = GroupInfo(
-                        uuid=group_dict.get('uuid', ''),
+                        uuid=group_uuid,
                         name=group_dict.get('name', ''),
-                        participants=group_dict.get('participants', []),
+                        participants=index,
                         created_at=group_dict.get('created_at', '')
                     )
-                    self.available_groups.append(group)
+                    groups.append(group)
+                self.available_groups = groups
+                self._group_fragments = {}
                 
                 logger.info(f"Loaded {len(self.available_groups)} groups from {self.available_groups_file}")
             else:
@@ -129,22 +530,106 @@ class WhatsAppPilatesBot:
             logger.error(f"Error loading available_groups: {e}")
             self.available_groups = []
     
-    def save_weekly_progress(self):
-        """Save weekly_progress to JSON file"""
-        try:
-            # Convert WeeklyProgress objects to dictionaries
-            progress_data = {}
+    def weekly_progress_data(self) -> Dict[str, Dict]:
+        """weekly_progress as JSON-ready dictionaries keyed by group uuid"""
+        # Convert WeeklyProgress objects to dictionaries
+        progress_data = {}
+        with self._progress_lock:
             for group_uuid, progress in self.weekly_progress.items():
                 progress_data[group_uuid] = {
                     'group_uuid': progress.group_uuid,
                     'week_start': progress.week_start,
                     'completed_members': list(progress.completed_members),  # Convert set to list
-                    'completed_members_info': progress.completed_members_info,
+                    'completed_members_info': dict(progress.completed_members_info),
                     'messages_analyzed': list(progress.messages_analyzed)  # Convert set to list
                 }
+        return progress_data
+    
+    def restore_weekly_progress(self, progress_data: Dict[str, Dict]):
+        """Replace weekly_progress from dictionaries produced by weekly_progress_data"""
+        # Convert dictionaries back to WeeklyProgress objects
+        restored: Dict[str, WeeklyProgress] = {}
+        for group_uuid, progress_dict in progress_data.items():
+            # Ensure backward compatibility - add completed_members_info if missing
+            if 'completed_members_info' not in progress_dict:
+                progress_dict['completed_members_info'] = {}
+            
+            index = self.participant_index(group_uuid)
+            progress = WeeklyProgress(
+                group_uuid=progress_dict.get('group_uuid', ''),
+                week_start=progress_dict.get('week_start', ''),
+                participants=index,
+                completed_mask=index.mask_of(progress_dict.get('completed_members', [])),
+                completed_members_info=progress_dict.get('completed_members_info', {}),
+                messages_analyzed=set(progress_dict.get('messages_analyzed', []))  # Convert list to set
+            )
+            restored[group_uuid] = progress
+        with self._progress_lock:
+            self.weekly_progress = restored
+    
+    def take_weekly_progress(self) -> Dict[str, WeeklyProgress]:
+        """Swap in an empty weekly_progress and return the old one.
+
+        Webhook threads insert under _progress_lock, so the returned dict is no
+        longer touched and can be reported on while new messages start the
+        next progress.
+        """
+        with self._progress_lock:
+            taken, self.weekly_progress = self.weekly_progress, {}
+        self.persistence.mark_dirty('weekly_progress')
+        return taken
+    
+    def _progress_snapshot(self) -> Dict[str, WeeklyProgress]:
+        with self._progress_lock:
+            return dict(self.weekly_progress)
+    
+    def week_history_data(self, week_start: str = '', all_groups: bool = True,
+                          progress_by_group: Dict[str, WeeklyProgress] = None) -> Dict[str, Dict[str, Dict[str, List[str]]]]:
+        """Roster and completed members per group, grouped by week_start.
+
+        Reads progress_by_group (default: a snapshot of weekly_progress). With
+        all_groups, tracked groups without progress (a quiet week) are included
+        under week_start (default: the current week) with nobody completed, so
+        history does not skip their missed weeks.
+        """
+        if progress_by_group is None:
+            progress_by_group = self._progress_snapshot()
+        weeks: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+        for group_uuid, progress in progress_by_group.items():
+            index = progress.participants
+            weeks.setdefault(progress.week_start, {})[group_uuid] = {
+                'roster': index.numbers_in(index.members & ~index.bit(self.bot_number)),
+                'completed': index.numbers_in(progress.completed_mask),
+            }
+        if all_groups:
+            week_start = week_start or self.get_current_week_start()
+            for group in self.available_groups:
+                if group.uuid in progress_by_group:
+                    continue
+                index = group.participants
+                weeks.setdefault(week_start, {})[group.uuid] = {
+                    'roster': index.numbers_in(index.members & ~index.bit(self.bot_number)),
+                    'completed': [],
+                }
+        return weeks
+    
+    def previous_week_start(self) -> str:
+        return (self.week_clock.current()[1] - timedelta(days=7)).strftime('%Y-%m-%d')
+    
+    def archive_week_history(self, weeks: Dict[str, Dict[str, Dict[str, List[str]]]] = None):
+        """Record weekly progress (or week_history_data from shards) in the history store"""
+        if weeks is None:
+            weeks = self.week_history_data()
+        for week_start, groups in weeks.items():
+            self.history.record_week(week_start, groups)
+    
+    def save_weekly_progress(self):
+        """Save weekly_progress to JSON file"""
+        try:
+            progress_data = self.weekly_progress_data()
             
-            with open(self.weekly_progress_file, 'w', encoding='utf-8') as f:
-                json.dump(progress_data, f, indent=2, ensure_ascii=False)
+            with tracing.span('save', file='weekly_progress.json'):
+                write_state(self.weekly_progress_file, progress_data)
             
             logger.info(f"Saved weekly progress for {len(progress_data)} groups to {self.weekly_progress_file}")
             
@@ -154,25 +639,9 @@ class WhatsAppPilatesBot:
     def load_weekly_progress(self):
         """Load weekly_progress from JSON file"""
         try:
-            if os.path.exists(self.weekly_progress_file):
-                with open(self.weekly_progress_file, 'r', encoding='utf-8') as f:
-                    progress_data = json.load(f)
-                
-                # Convert dictionaries back to WeeklyProgress objects
-                self.weekly_progress = {}
-                for group_uuid, progress_dict in progress_data.items():
-                    # Ensure backward compatibility - add completed_members_info if missing
-                    if 'completed_members_info' not in progress_dict:
-                        progress_dict['completed_members_info'] = {}
-                    
-                    progress = WeeklyProgress(
-                        group_uuid=progress_dict.get('group_uuid', ''),
-                        week_start=progress_dict.get('week_start', ''),
-                        completed_members=set(progress_dict.get('completed_members', [])),  # Convert list to set
-                        completed_members_info=progress_dict.get('completed_members_info', {}),
-                        messages_analyzed=set(progress_dict.get('messages_analyzed', []))  # Convert list to set
-                    )
-                    self.weekly_progress[group_uuid] = progress
+            progress_data = self._load_state(self.weekly_progress_file)
+            if progress_data is not None:
+                self.restore_weekly_progress(progress_data)
                 
                 logger.info(f"Loaded weekly progress for {len(self.weekly_progress)} groups from {self.weekly_progress_file}")
             else:
@@ -187,7 +656,9 @@ class WhatsAppPilatesBot:
         try:
             # Convert AutoReplyMember objects to dictionaries
             members_data = []
-            for member in self.auto_reply_members:
+            with self._auto_reply_lock:
+                members = list(self.auto_reply_members)
+            for member in members:
                 members_data.append({
                     'phone_number': member.phone_number,
                     'group_uuid': member.group_uuid,
@@ -195,31 +666,46 @@ class WhatsAppPilatesBot:
                     'created_at': member.created_at
                 })
             
-            with open(self.auto_reply_members_file, 'w', encoding='utf-8') as f:
-                json.dump(members_data, f, indent=2, ensure_ascii=False)
+            with tracing.span('save', file='auto_reply_members.json'):
+                write_state(self.auto_reply_members_file, members_data)
             
             logger.info(f"Saved {len(members_data)} auto reply members to {self.auto_reply_members_file}")
             
         except Exception as e:
             logger.error(f"Error saving auto_reply_members: {e}")
     
+    @staticmethod
+    def auto_reply_members_from_data(members_data: List[Dict]) -> List[AutoReplyMember]:
+        """Convert dictionaries back to AutoReplyMember objects"""
+        members = []
+        for member_dict in members_data:
+            member = AutoReplyMember(
+                phone_number=sys.intern(member_dict.get('phone_number', '')),
+                group_uuid=member_dict.get('group_uuid', ''),
+                message_sent=member_dict.get('message_sent', ''),
+                created_at=member_dict.get('created_at', '')
+            )
+            members.append(member)
+        return members
+    
+    def clear_auto_reply_members(self):
+        """Start the week's auto-reply list; last week's reminders are no longer answered"""
+        with self._auto_reply_lock:
+            self.auto_reply_members = []
+        self.persistence.mark_dirty('auto_reply_members')
+    
+    def add_auto_reply_member(self, member: AutoReplyMember):
+        """Register a reminded member, so their reply is answered even while the report still runs"""
+        with self._auto_reply_lock:
+            self.auto_reply_members.append(member)
+        self.persistence.mark_dirty('auto_reply_members')
+    
     def load_auto_reply_members(self):
         """Load auto_reply_members from JSON file"""
         try:
-            if os.path.exists(self.auto_reply_members_file):
-                with open(self.auto_reply_members_file, 'r', encoding='utf-8') as f:
-                    members_data = json.load(f)
-                
-                # Convert dictionaries back to AutoReplyMember objects
-                self.auto_reply_members = []
-                for member_dict in members_data:
-                    member = AutoReplyMember(
-                        phone_number=member_dict.get('phone_number', ''),
-                        group_uuid=member_dict.get('group_uuid', ''),
-                        message_sent=member_dict.get('message_sent', ''),
-                        created_at=member_dict.get('created_at', '')
-                    )
-                    self.auto_reply_members.append(member)
+            members_data = self._load_state(self.auto_reply_members_file)
+            if members_data is not None:
+                self.auto_reply_members = self.auto_reply_members_from_data(members_data)
                 
                 logger.info(f"Loaded {len(self.auto_reply_members)} auto reply members from {self.auto_reply_members_file}")
             else:
@@ -231,9 +717,7 @@ class WhatsAppPilatesBot:
 
     def get_current_week_start(self) -> str:
         """Get the start of current week (Monday) in Ireland timezone"""
-        now = datetime.now(self.ireland_tz)
-        monday = now - timedelta(days=now.weekday())
-        return monday.strftime('%Y-%m-%d')
+        return self.week_clock.current()[0]
     
     def is_group_old_enough(self, group_created_at: str) -> bool:
         """Check if group is old enough to be safely monitored (prevents account bans)"""
@@ -244,10 +728,9 @@ class WhatsAppPilatesBot:
                 return False
             
             # Parse group creation date
-            if group_created_at.endswith('Z'):
-                created_date = datetime.fromisoformat(group_created_at.replace('Z', '+00:00'))
-            else:
-                created_date = datetime.fromisoformat(group_created_at)
+            created_date = parse_timestamp(group_created_at)
+            if created_date is None:
+                raise ValueError(f"Invalid creation date '{group_created_at}'")
             
             # Convert to Ireland timezone
             created_date = created_date.astimezone(self.ireland_tz)
@@ -268,12 +751,60 @@ class WhatsAppPilatesBot:
             # Return True for safety if we can't determine age
             return True
     
+    def is_group_old_enough_cached(self, group_uuid: str, group_created_at: str) -> bool:
+        """is_group_old_enough with the verdict cached per group until week rollover.
+
+        A "too new" verdict also expires as soon as the group reaches the minimum age.
+        """
+        week_start, _ = self.week_clock.current()
+        if week_start != self._group_age_week:
+            self._group_age_verdicts = {}
+            self._group_age_week = week_start
+        
+        now = time.time()
+        cached = self._group_age_verdicts.get(group_uuid)
+        if cached is not None and now < cached[1]:
+            return cached[0]
+        
+        if not group_created_at:
+            # Missing creation date from the webhook: fall back to the discovered group's
+            group = self._groups_by_uuid.get(group_uuid)
+            group_created_at = group.created_at if group else ''
+        
+        # Without any creation date the message is let through, as before caching
+        verdict = self.is_group_old_enough(group_created_at) if group_created_at else True
+        valid_until = float('inf')
+        if not verdict:
+            created_date = parse_timestamp(group_created_at)
+            if created_date is not None:
+                valid_until = created_date.timestamp() + config.MIN_GROUP_AGE_DAYS * 86400
+        self._group_age_verdicts[group_uuid] = (verdict, valid_until)
+        return verdict
+    
+    def _is_from_previous_week(self, event: GroupMessageEvent) -> bool:
+        return event.created_at is not None and event.created_at < self.week_clock.current()[1]
+    
+    def _current_progress(self, group_uuid: str):
+        """This week's progress for a group, or None if it has none yet"""
+        progress = self.weekly_progress.get(group_uuid)
+        if progress is None or progress.week_start != self.week_clock.current()[0]:
+            return None
+        return progress
+    
+    def _is_already_analyzed(self, event: GroupMessageEvent) -> bool:
+        progress = self._current_progress(event.group_uuid)
+        return progress is not None and event.message_id in progress.messages_analyzed
+    
+    def _is_already_completed(self, event: GroupMessageEvent) -> bool:
+        progress = self._current_progress(event.group_uuid)
+        return progress is not None and progress.is_completed(event.from_number)
+    
     def find_pilates_groups(self) -> List[GroupInfo]:
         """Find all groups containing 'pilates' in their name (case insensitive)"""
         try:
             # Get all groups for the bot number
             url = f"{self.base_url}/groups/{self.bot_number}"
-            response = requests.get(url, headers={'X-User-API-Key': self.api_key})
+            response = self.http.get(url, headers={'X-User-API-Key': self.api_key})
             
             if response.status_code != 200:
                 logger.error(f"Failed to get groups: {response.text}")
@@ -281,6 +812,7 @@ class WhatsAppPilatesBot:
             
             groups_data = response.json()
             pilates_groups = []
+            changed: List[str] = []
             
             for group in groups_data.get('data', []):
                 group_name = group.get('wa_group_name', '').lower()
@@ -295,19 +827,26 @@ class WhatsAppPilatesBot:
                             logger.info(f"Skipping recently created Pilates group: {group['wa_group_name']} (created: {group_created_at})")
                             continue
                         
+                        if self.apply_participants(group['uuid'], self._participant_numbers(group_details)):
+                            changed.append(group['uuid'])
                         group_info = GroupInfo(
                             uuid=group['uuid'],
                             name=group['wa_group_name'],
-                            participants=group_details.get('participants', []),
+                            participants=self.participant_index(group['uuid']),
                             created_at=group_created_at
                         )
+                        known = self._groups_by_uuid.get(group['uuid'])
+                        if not known or (known.name, known.created_at) != (group_info.name, group_info.created_at):
+                            changed.append(group['uuid'])
                         pilates_groups.append(group_info)
                         age_days = (datetime.now(self.ireland_tz) - datetime.fromisoformat(group_created_at.replace('Z', '+00:00')).astimezone(self.ireland_tz)).days if group_created_at else "unknown"
                         logger.info(f"Found Pilates group: {group['wa_group_name']} ({group['uuid']}) - Age: {age_days} days")
             
-            # Update available_groups and save to file
+            # Update available_groups and save to file if anything differs
+            removed = set(self._groups_by_uuid) - {group.uuid for group in pilates_groups}
             self.available_groups = pilates_groups
-            self.save_available_groups()
+            if changed or removed or not os.path.exists(self.available_groups_file):
+                self.save_available_groups(changed)
             
             return pilates_groups
         
@@ -315,11 +854,60 @@ class WhatsAppPilatesBot:
             logger.error(f"Error finding Pilates groups: {e}")
             return []
     
+    @staticmethod
+    def _participant_numbers(group_details: Dict) -> List[str]:
+        return [p['phone_number'] for p in group_details.get('participants', []) if p.get('phone_number')]
+    
+    def apply_participants(self, group_uuid: str, numbers: Iterable[str]) -> List[MembershipChange]:
+        """Sync a group's participant index and emit a MembershipChange per join/leave.
+
+        A group seen for the first time only gets its index filled, without events.
+        """
+        index = self.participant_index(group_uuid)
+        first_sync = not index.numbers
+        joined, left = index.sync(numbers)
+        if first_sync:
+            return []
+        
+        changes = [MembershipChange(group_uuid, phone_number, 'joined') for phone_number in index.numbers_in(joined)]
+        changes += [MembershipChange(group_uuid, phone_number, 'left') for phone_number in index.numbers_in(left)]
+        for change in changes:
+            logger.info(f"Member {change.phone_number} {change.kind} group {group_uuid}")
+            for listener in self.membership_listeners:
+                try:
+                    listener(change)
+                except Exception as e:
+                    logger.error(f"Membership listener failed on {change}: {e}")
+        return changes
+    
+    def refresh_participants(self) -> List[MembershipChange]:
+        """Re-read participants of the known groups and apply only the differences.
+
+        Unlike find_pilates_groups this does not list groups again; only groups
+        whose membership changed are touched in the indexes and on disk.
+        """
+        changes: List[MembershipChange] = []
+        changed: List[str] = []
+        for group in self.available_groups:
+            group_details = self.get_group_details(group.uuid).get('data', None)
+            if not group_details:
+                continue
+            group_changes = self.apply_participants(group.uuid, self._participant_numbers(group_details))
+            if group_changes:
+                changed.append(group.uuid)
+                changes.extend(group_changes)
+        
+        if changed:
+            self.save_available_groups(changed)
+        logger.info(f"Refreshed participants of {len(self.available_groups)} groups: "
+                    f"{len(changes)} changes in {len(changed)} groups")
+        return changes
+    
     def get_group_details(self, group_uuid: str) -> Dict:
         """Get detailed information about a specific group"""
         try:
             url = f"{self.base_url}/group/{group_uuid}"
-            response = requests.get(url, headers={'X-User-API-Key': self.api_key})
+            response = self.http.get(url, headers={'X-User-API-Key': self.api_key})
             
             if response.status_code == 200:
                 return response.json()
@@ -335,7 +923,7 @@ class WhatsAppPilatesBot:
         """Get messages from a specific group"""
         try:
             url = f"{self.base_url}/groups/messages/{group_uuid}?page_number={page}"
-            response = requests.get(url, headers={'X-User-API-Key': self.api_key})
+            response = self.http.get(url, headers={'X-User-API-Key': self.api_key})
             
             if response.status_code == 200:
                 data = response.json()
@@ -348,13 +936,23 @@ class WhatsAppPilatesBot:
             logger.error(f"Error getting group messages: {e}")
             return []
     
-    def analyze_message_with_gemini(self, message_text: str) -> bool:
+    def generate_text(self, feature: str, prompt: str, model=None, group_uuid: str = '') -> str:
+        """One non-streamed Gemini call, accounted in the token ledger under feature"""
+        model = model or self.model
+        started = self.token_ledger.clock()
+        with tracing.span('gemini', feature=feature, model=getattr(model, 'model_name', '')):
+            response = model.generate_content(prompt)
+            text = response.text.strip()
+        self.token_ledger.record(feature, getattr(model, 'model_name', ''), prompt, text, usage_of(response),
+                                 self.token_ledger.clock() - started, group_uuid)
+        return text
+    
+    def analyze_message_with_gemini(self, message_text: str, group_uuid: str = '') -> bool:
         """Use Gemini AI to analyze if message indicates weekly plan completion"""
         try:
-            prompt = config.GEMINI_ANALYSIS_PROMPT.format(message_text=message_text)
+            prompt = self.classifier_prompt.render(message_text=message_text)
             
-            response = self.model.generate_content(prompt)
-            result = response.text.strip().upper()
+            result = self.generate_text('completion', prompt, self.classifier_model, group_uuid).upper()
             
             logger.info(f"Gemini analysis for '{message_text[:50]}...': {result}")
             return result == "YES"
@@ -373,7 +971,11 @@ class WhatsAppPilatesBot:
                 "text": message
             }
             
-            response = requests.post(url, headers=self.headers, json=payload)
+            with tracing.span('send', to='group') as span:
+                if self.rate_limiter:
+                    span.set('throttled_s', round(self.rate_limiter.acquire(), 3))
+                response = self.http.post(url, headers=self.headers, json=payload)
+                span.set('status', response.status_code)
             
             if response.status_code == 200:
                 logger.info(f"Successfully sent group message to {group_uuid}")
@@ -396,7 +998,11 @@ class WhatsAppPilatesBot:
                 "text": message
             }
             
-            response = requests.post(url, headers=self.headers, json=payload)
+            with tracing.span('send', to='individual') as span:
+                if self.rate_limiter:
+                    span.set('throttled_s', round(self.rate_limiter.acquire(), 3))
+                response = self.http.post(url, headers=self.headers, json=payload)
+                span.set('status', response.status_code)
             
             if response.status_code == 200:
                 logger.info(f"Successfully sent individual message to {phone_number}")
@@ -412,29 +1018,49 @@ class WhatsAppPilatesBot:
     def saturday_report(self):
         """Send weekly reports on Saturday at 8 AM Ireland time"""
         logger.info("Generating Saturday weekly reports...")
+        self.ensure_warm()
 
-        self.find_pilates_groups()
-        self.auto_reply_members = []
+        # Membership deltas only; new groups are picked up by the Monday rediscovery
+        self.refresh_participants()
         
-        for uuid, progress in self.weekly_progress.items():
-            group = None
-            
-            for g in self.available_groups:
-                if g.uuid == uuid:
-                    group = g
-                    break
+        # Report on the week's progress as taken now; messages arriving during the
+        # report go into the fresh progress and are archived on Monday
+        week_progress = self.take_weekly_progress()
+        self.archive_week_history(self.week_history_data(progress_by_group=week_progress))
+        
+        # Members are added to auto_reply_members as each reminder is sent
+        self.clear_auto_reply_members()
+        reminded = self.run_group_reports(week_progress, self.add_auto_reply_member)
+        
+        # Critical event: write now rather than within the flush interval
+        self.persistence.flush()
+        logger.info(f"Updated auto_reply_members list with {len(reminded)} members")
+    
+    def run_group_reports(self, progress_by_group: Dict[str, WeeklyProgress] = None,
+                          on_reminded: Callable[[AutoReplyMember], None] = None) -> List[AutoReplyMember]:
+        """Send this week's congratulations and reminders for every group in progress_by_group.
+
+        Defaults to a snapshot of weekly_progress. on_reminded is called with
+        each member right after their reminder is sent; all of them are also
+        returned.
+        """
+        if progress_by_group is None:
+            progress_by_group = self._progress_snapshot()
+        auto_reply_members: List[AutoReplyMember] = []
+        reminded = set()
+        
+        for uuid, progress in progress_by_group.items():
+            group = self._groups_by_uuid.get(uuid)
 
             if not progress or not group:
                 continue
             
-            # Ensure backward compatibility - add completed_members_info if missing
-            if not hasattr(progress, 'completed_members_info'):
-                progress.completed_members_info = {}
-            
-            completed_numbers = progress.completed_members
+            # Set algebra over the group's participant bitmap: incomplete = all - completed - bot
+            index = group.participants
+            completed_numbers = index.numbers_in(progress.completed_mask)
             completed_members_info = progress.completed_members_info
-            all_participants = {p.get('phone_number', '') for p in group.participants if p.get('phone_number')}
-            incomplete_numbers = all_participants - completed_numbers
+            incomplete_mask = index.members & ~progress.completed_mask & ~index.bit(self.bot_number)
+            incomplete_numbers = index.numbers_in(incomplete_mask)
             
             # Send congratulations to group for completed members
             if completed_numbers:
@@ -454,268 +1080,263 @@ class WhatsAppPilatesBot:
 {names_list} completed their weekly pilates plan this week. Keep up the great work! 💪"""
                 # else:  # If many members, just show count
                     # group_message = config.GROUP_CONGRATULATIONS_TEMPLATE.format(count=completed_count)
-                group_message = self.generate_varied_message(group_message)
+                group_message = self.generate_varied_message(group_message, group.uuid)
                 #### send messages to group ####
                 self.send_group_message(group.uuid, group_message)
                 logger.info(f"sent to group {group.name}: {group_message}")
             
-            print("-------------------------------- incompleted members --------------------------------")
+            logger.debug(f"Sending reminders to {len(incomplete_numbers)} incomplete members of {group.name}")
             # Send individual reminders to incomplete members and update auto_reply_members
             for phone_number in incomplete_numbers:
                 if phone_number and phone_number != self.bot_number:
                     # Send reminder message
-                    message = self.generate_varied_message(config.INDIVIDUAL_REMINDER_TEMPLATE)
+                    message = self.generate_varied_message(config.INDIVIDUAL_REMINDER_TEMPLATE, group.uuid)
                     self.send_individual_message(phone_number, message)
                     logger.info(f"sent to {phone_number}: {message}")
                     
-                    # Add to auto_reply_members for future auto-replies
-                    # Check if member is already in auto_reply_members
-                    existing_member = None
-                    for member in self.auto_reply_members:
-                        if member.phone_number == phone_number and member.group_uuid == group.uuid:
-                            existing_member = member
-                            break
-                    
-                    # If not already in list, add them
-                    if not existing_member:
+                    # Add to auto_reply_members for future auto-replies, once per member and group
+                    if (phone_number, group.uuid) not in reminded:
+                        reminded.add((phone_number, group.uuid))
                         current_time = datetime.now(self.ireland_tz).isoformat()
                         auto_reply_member = AutoReplyMember(
-                            phone_number=phone_number,
+                            phone_number=phone_number,  # Already interned by the participant index
                             group_uuid=group.uuid,
                             message_sent=message,  # Store the actual varied message sent
                             created_at=current_time
                         )
-                        self.auto_reply_members.append(auto_reply_member)
+                        auto_reply_members.append(auto_reply_member)
+                        if on_reminded:
+                            on_reminded(auto_reply_member)
                         logger.info(f"Added {phone_number} to auto_reply_members for group {group.name}")
             
             logger.info(f"Group {group.name}: {len(completed_numbers)} completed, {len(incomplete_numbers)} reminded")
         
-        # Save updated auto_reply_members after processing all groups
-        self.weekly_progress = {}
-        self.save_weekly_progress()
-        self.save_auto_reply_members()
-        logger.info(f"Updated auto_reply_members list with {len(self.auto_reply_members)} members")
+        return auto_reply_members
     
     def process_webhook_message(self, webhook_data: Dict):
         """Process incoming webhook message from 2chat"""
         try:
-            # Extract message details from webhook data (matches listener.json format)
-            message_id = webhook_data.get('id', '')
-            message_uuid = webhook_data.get('uuid', '')
-            created_at = webhook_data.get('created_at', '')
-            sent_by = webhook_data.get('sent_by', '')
-            
-            # Get message text
-            message_obj = webhook_data.get('message', {})
-            text_content = message_obj.get('text', '')
-            
-            # Get participant (sender) information
-            participant = webhook_data.get('participant', {})
-            from_number = participant.get('phone_number', '')
-            sender_name = participant.get('pushname', '')
-            
-            # Get group information
-            group_info = webhook_data.get('group', {})
-            group_uuid = group_info.get('uuid', '') if group_info else ''
-            group_name = group_info.get('wa_group_name', '') if group_info else ''
-            group_created_at = group_info.get('wa_created_at', '') if group_info else ''
-            
-            # Get bot's channel phone number
-            channel_phone_number = webhook_data.get('channel_phone_number', '')
-            
-            logger.info(f"Processing webhook message: {message_id} from {from_number} ({sender_name}) in group: {group_name}")
-            
-            # Check if this group is in our available pilates groups
-            group_found = False
-            for available_group in self.available_groups:
-                if available_group.uuid == group_uuid:
-                    group_found = True
-                    break
-            
-            if not group_found:
-                logger.info(f"Group {group_name} not in available pilates groups, skipping")
-                return
-
-            # Only process user messages (not bot messages)
-            if sent_by != 'user':
-                logger.info(f"Skipping non-user message, sent_by: {sent_by}")
-                return
-            
-            # Skip if message is from bot itself
-            if from_number == self.bot_number or channel_phone_number == from_number:
-                logger.info("Skipping message from bot itself")
-                return
-            
-            # Only process group messages
-            if not group_uuid or not group_info:
-                logger.info("Skipping non-group message")
-                return
-            
-            # Check if this is a pilates group by name
-            if not group_name or config.PILATES_KEYWORD.lower() not in group_name.lower():
-                logger.info(f"Message not from a pilates group: {group_name}")
+            event = group_event_from_dict(webhook_data)
+        except IgnoredEvent as e:
+            logger.info(f"Skipping webhook: {e}")
+            return
+        except WebhookDecodeError as e:
+            logger.error(f"Invalid group webhook: {e}")
+            return
+        self.handle_group_event(event)
+    
+    def handle_group_event(self, event: GroupMessageEvent):
+        """Track weekly completion for a decoded group message event"""
+        with tracing.span('handle_group_event', group_uuid=event.group_uuid):
+            self._handle_group_event(event)
+    
+    def _handle_group_event(self, event: GroupMessageEvent):
+        self.ensure_warm()
+        try:
+            message_id = event.message_id
+            from_number = event.from_number
+            sender_name = event.sender_name
+            group_uuid = event.group_uuid
+            group_name = event.group_name
+            
+            # Cheap rejects first: non-user, bot, unknown group, stale, too new, duplicates
+            with tracing.span('filters') as span:
+                admitted = self.group_filters.admit(event)
+                span.set('admitted', admitted)
+            if not admitted:
                 return
             
-            # Check if group is old enough (safety feature)
-            if group_created_at and not self.is_group_old_enough(group_created_at):
-                logger.info(f"Skipping message from recently created group: {group_name} (created: {group_created_at})")
-                return
+            logger.info(f"Processing webhook message: {message_id} from {from_number} ({sender_name}) in group: {group_name}")
             
             # Process the message for completion tracking
             week_start = self.get_current_week_start()
             
-            # Initialize weekly progress if not exists
-            if group_uuid not in self.weekly_progress:
-                self.weekly_progress[group_uuid] = WeeklyProgress(
-                    group_uuid=group_uuid,
-                    week_start=week_start,
-                    completed_members=set(),
-                    completed_members_info={},
-                    messages_analyzed=set()
-                )
-            
-            progress = self.weekly_progress[group_uuid]
-            
-            # Ensure backward compatibility - add completed_members_info if missing
-            if not hasattr(progress, 'completed_members_info'):
-                progress.completed_members_info = {}
-            
-            # Reset if new week
-            if progress.week_start != week_start:
-                progress.week_start = week_start
-                progress.completed_members.clear()
-                progress.completed_members_info.clear()
-                progress.messages_analyzed.clear()
-            
-            # Skip if already analyzed
-            if message_id in progress.messages_analyzed:
-                logger.info(f"Message {message_id} already analyzed")
-                return
-
-            if from_number in progress.completed_members:
-                logger.info(f"This user {from_number}:{sender_name} complete his work.")
-                return
-            
-            # Check if message is from this week
-            try:
-                # Parse timestamp (format: "2025-08-15T07:56:11")
-                if created_at:
-                    if 'Z' in created_at:
-                        msg_datetime = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    else:
-                        # Add timezone info if missing
-                        msg_datetime = datetime.fromisoformat(created_at)
-                        if msg_datetime.tzinfo is None:
-                            msg_datetime = msg_datetime.replace(tzinfo=pytz.UTC)
-                    
-                    msg_datetime = msg_datetime.astimezone(self.ireland_tz)
-                    week_start_date = datetime.strptime(week_start, '%Y-%m-%d').replace(tzinfo=self.ireland_tz)
-                    
-                    if msg_datetime < week_start_date:
-                        logger.info("Message is from previous week, skipping")
-                        return
-            except Exception as e:
-                logger.warning(f"Could not parse timestamp '{created_at}': {e}")
-                # Assume message is current if parsing fails
-                pass
-            
-            # Analyze message with Gemini
-            if text_content and self.analyze_message_with_gemini(text_content):
-                progress.completed_members.add(from_number)
-                progress.completed_members_info[from_number] = sender_name or "Unknown"
-                logger.info(f"Member {from_number} ({sender_name}) completed weekly plan in group {group_name}")
-            
-            progress.messages_analyzed.add(message_id)
+            # Analyze message with Gemini (outside the progress lock)
+            completed = bool(event.text) and self.analyze_message_with_gemini(event.text, group_uuid)
+            
+            with self._progress_lock:
+                # Initialize weekly progress if not exists
+                if group_uuid not in self.weekly_progress:
+                    self.weekly_progress[group_uuid] = WeeklyProgress(
+                        group_uuid=group_uuid,
+                        week_start=week_start,
+                        participants=self.participant_index(group_uuid),
+                        completed_mask=0,
+                        completed_members_info={},
+                        messages_analyzed=set()
+                    )
+                
+                progress = self.weekly_progress[group_uuid]
+                
+                # Reset if new week
+                if progress.week_start != week_start:
+                    progress.reset(week_start)
+                
+                if completed:
+                    progress.mark_completed(from_number)
+                    progress.completed_members_info[from_number] = sender_name or "Unknown"
+                    logger.info(f"Member {from_number} ({sender_name}) completed weekly plan in group {group_name}")
+                
+                progress.messages_analyzed.add(message_id)
             
-            # Save progress after each update
-            self.save_weekly_progress()
+            # Written by the background flusher within PERSIST_INTERVAL_MS
+            self.persistence.mark_dirty('weekly_progress')
             
         except Exception as e:
             logger.error(f"Error processing webhook message: {e}")
-            logger.error(f"Webhook data: {webhook_data}")
+            logger.error(f"Webhook event: {event}")
     
     def process_private_message(self, webhook_data: Dict):
         """Process incoming private message from 2chat"""
         try:
-            # Extract message details from webhook data
-            message_id = webhook_data.get('id', '')
-            message_uuid = webhook_data.get('uuid', '')
-            sent_by = webhook_data.get('sent_by', '')
-            
-            # Get message text
-            message_obj = webhook_data.get('message', {})
-            text_content = message_obj.get('text', '')
-            
-            # Get sender information
-            from_number =webhook_data.get('remote_phone_number', '')
-            sender_name = webhook_data.get('contact', {}).get('first_name', '') or webhook_data.get('contact', {}).get('last_name', '') or webhook_data.get('contact', {}).get('friendly_name', '')
-            
-            # Get bot's channel phone number
-            channel_phone_number = webhook_data.get('channel_phone_number', '')
+            event = private_event_from_dict(webhook_data)
+        except WebhookDecodeError as e:
+            logger.error(f"Invalid private webhook: {e}")
+            return
+        self.handle_private_event(event)
+    
+    def handle_private_event(self, event: PrivateMessageEvent):
+        """Auto-reply to a decoded private message event"""
+        with tracing.span('handle_private_event'):
+            self._handle_private_event(event)
+    
+    def _handle_private_event(self, event: PrivateMessageEvent):
+        self.ensure_warm()
+        try:
+            from_number = event.from_number
+            sender_name = event.sender_name
             
-            logger.info(f"Processing private message: {message_id} from {from_number} ({sender_name})")
+            logger.info(f"Processing private message: {event.message_id} from {from_number} ({sender_name})")
             
             # Only process user messages (not bot messages)
-            if sent_by != 'user':
-                logger.info(f"Skipping non-user message, sent_by: {sent_by}")
+            if event.sent_by != 'user':
+                logger.info(f"Skipping non-user message, sent_by: {event.sent_by}")
                 return
             
             # Skip if message is from bot itself
-            if from_number == self.bot_number or channel_phone_number == from_number:
+            if from_number == self.bot_number or event.channel_phone_number == from_number:
                 logger.info("Skipping message from bot itself")
                 return
             
             # Check if this sender is in auto_reply_members
-            auto_reply_member = None
-            for member in self.auto_reply_members:
-                if member.phone_number == from_number:
-                    auto_reply_member = member
-                    break
-            
-            if not auto_reply_member:
+            if not self.find_auto_reply_member(from_number):
                 logger.info(f"User {from_number} not in auto_reply_members list")
                 return
             
-            # Generate auto reply using Gemini
-            reply_message = self.generate_auto_reply(auto_reply_member.message_sent, text_content, sender_name)
+            # The reply counts against the private lane from now on; raises LaneFull when it is full
+            if self.admission is not None:
+                self.admission.reserve('private')
             
-            if reply_message:
-                # Send the auto reply
-                success = self.send_individual_message(from_number, reply_message)
-                
-                if success:
-                    logger.info(f"Auto reply sent to {from_number} ({sender_name}): {reply_message}")
-                    
-                    # Remove member from auto_reply_members after successful reply
-                    self.auto_reply_members.remove(auto_reply_member)
-                    self.save_auto_reply_members()
-                    logger.info(f"Removed {from_number} from auto_reply_members")
-                else:
-                    logger.error(f"Failed to send auto reply to {from_number}")
-            else:
-                logger.error(f"Failed to generate auto reply for {from_number}")
+            # Replies to one sender are serialised; a burst inside the window becomes one batch
+            self.private_executor.submit((self.bot_number, from_number), self._reply_to_member,
+                                         (time.perf_counter(), event))
                 
+        except LaneFull:
+            raise
         except Exception as e:
             logger.error(f"Error processing private message: {e}")
-            logger.error(f"Webhook data: {webhook_data}")
+            logger.error(f"Webhook event: {event}")
     
-    def generate_auto_reply(self, original_message: str, user_response: str, user_name: str) -> str:
-        """Generate auto reply using Gemini based on original message and user response"""
-        try:
-            prompt = f"""
-You are a friendly pilates instructor bot. You previously sent this message to a member who didn't complete their weekly pilates plan:
-"{original_message}"
-
-The member ({user_name}) has now replied with:
-"{user_response}"
-
-Generate a supportive, encouraging, and personalized response to their message. Keep it friendly and motivating. Consider their response and provide appropriate support or encouragement for their pilates journey.
+    def find_auto_reply_member(self, phone_number: str) -> Optional[AutoReplyMember]:
+        with self._auto_reply_lock:
+            for member in self.auto_reply_members:
+                if member.phone_number == phone_number:
+                    return member
+        return None
+    
+    def _reply_to_member(self, key: Tuple[str, str], items: List[Tuple[float, PrivateMessageEvent]]):
+        """Send one auto reply for a batch of consecutive messages from the same sender"""
+        events = [event for _, event in items]
+        with tracing.span('auto_reply', messages=len(events)):
+            if self.admission is None:
+                self._reply_to_member_batch(key, events, items[0][0])
+                return
+            # Lane latency runs from the first message's arrival to the reply being sent
+            with self.admission.admit('private', block=True, reserved=len(items), arrived=items[0][0]):
+                self._reply_to_member_batch(key, events, items[0][0])
+    
+    def _reply_to_member_batch(self, key: Tuple[str, str], events: List[PrivateMessageEvent], arrived: float):
+        """Answer a batch of messages; arrived is the first one's time.perf_counter() arrival time"""
+        from_number = key[1]
+        sender_name = events[-1].sender_name
+        
+        # An earlier batch may already have answered this sender
+        auto_reply_member = self.find_auto_reply_member(from_number)
+        if not auto_reply_member:
+            logger.info(f"User {from_number} already answered, dropping {len(events)} message(s)")
+            return
+        
+        user_response = "\n".join(event.text for event in events if event.text)
+        if len(events) > 1:
+            logger.info(f"Coalesced {len(events)} messages from {from_number} into one reply")
+        
+        # Latencies run from the first message's arrival, so they include the
+        # coalescing window and executor queueing, as the member experiences it
+        outbound = PipelinedReply(lambda text: self.send_individual_message(from_number, text),
+                                  arrived, self.reply_latency['first_response'])
+        ack = None
+        if config.AUTO_REPLY_QUICK_ACK:
+            ack_after = max(0.0, config.AUTO_REPLY_QUICK_ACK_AFTER_SECONDS - (time.perf_counter() - arrived))
+            ack = threading.Timer(ack_after, outbound.put_if_first,
+                                  args=(config.AUTO_REPLY_QUICK_ACK,))
+            ack.daemon = True
+            ack.start()
+        
+        # With pipelined send the opening sentence goes out while the rest is still streaming
+        first_sentence = ''
+        on_text = None
+        if config.AUTO_REPLY_STREAMING and config.AUTO_REPLY_PIPELINED_SEND:
+            def on_text(text_so_far: str):
+                nonlocal first_sentence
+                if not first_sentence:
+                    match = FIRST_SENTENCE.match(text_so_far.lstrip())
+                    if match:
+                        first_sentence = match.group(1)
+                        outbound.put(first_sentence)
+        
+        # Generate auto reply using Gemini
+        reply_message = self.generate_auto_reply(auto_reply_member.message_sent, user_response, sender_name,
+                                                 on_text=on_text, group_uuid=auto_reply_member.group_uuid)
+        if ack:
+            ack.cancel()
+        
+        if reply_message:
+            remainder = reply_message
+            if first_sentence and reply_message.startswith(first_sentence):
+                remainder = reply_message[len(first_sentence):].strip()
+            if remainder:
+                outbound.put(remainder)
+        
+        # Send the auto reply
+        success = outbound.close()
+        if reply_message and success:
+            self.reply_latency['total'].record(time.perf_counter() - arrived)
+            logger.info(f"Auto reply sent to {from_number} ({sender_name}): {reply_message}")
+            
+            # Remove member from auto_reply_members after successful reply
+            with self._auto_reply_lock:
+                self.auto_reply_members = [m for m in self.auto_reply_members if m is not auto_reply_member]
+            self.persistence.mark_dirty('auto_reply_members')
+            logger.info(f"Removed {from_number} from auto_reply_members")
+        elif reply_message:
+            logger.error(f"Failed to send auto reply to {from_number}")
+        else:
+            logger.error(f"Failed to generate auto reply for {from_number}")
+    
+    def generate_auto_reply(self, original_message: str, user_response: str, user_name: str,
+                            on_text: Callable[[str], None] = None, group_uuid: str = '') -> str:
+        """Generate auto reply using Gemini based on original message and user response.
 
-Response should be in a conversational tone and not too long (2-3 sentences maximum).
-"""
+        When streaming, on_text is called with the text received so far after every chunk.
+        """
+        try:
+            prompt = self.prompts['auto_reply'].render(original_message=original_message,
+                                                       user_response=user_response, user_name=user_name)
             
-            response = self.model.generate_content(prompt)
-            reply = response.text.strip()
+            if config.AUTO_REPLY_STREAMING:
+                reply = self._stream_text('auto_reply', prompt, on_text, group_uuid)
+            else:
+                reply = self.generate_text('auto_reply', prompt, group_uuid=group_uuid)
             
             logger.info(f"Generated auto reply for {user_name}: {reply[:50]}...")
             return reply
@@ -724,14 +1345,36 @@ Response should be in a conversational tone and not too long (2-3 sentences maxi
             logger.error(f"Error generating auto reply with Gemini: {e}")
             return ""
     
-    def generate_varied_message(self, message: str) -> str:
-        prompt = f"""Give me one similar message related to this, not change names. It's about pilates class training. Only answer the message, no other text.
-Message: '{message}'"""
+    def _stream_text(self, feature: str, prompt: str, on_text: Callable[[str], None] = None,
+                     group_uuid: str = '') -> str:
+        """Consume a streamed Gemini response, timing the first chunk"""
+        started = self.token_ledger.clock()
+        parts: List[str] = []
+        usage = None
+        with tracing.span('gemini', feature=feature, model=getattr(self.model, 'model_name', ''), stream=True) as span:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                # Usage metadata, when reported, is complete on the last chunk
+                usage = usage_of(chunk) or usage
+                text = chunk.text
+                if not text:
+                    continue
+                if not parts:
+                    first_token = self.token_ledger.clock() - started
+                    self.reply_latency['first_token'].record(first_token)
+                    span.set('first_token_ms', round(first_token * 1000, 3))
+                parts.append(text)
+                if on_text:
+                    on_text(''.join(parts))
+        reply = ''.join(parts).strip()
+        self.token_ledger.record(feature, getattr(self.model, 'model_name', ''), prompt, reply, usage,
+                                 self.token_ledger.clock() - started, group_uuid)
+        return reply
+    
+    def generate_varied_message(self, message: str, group_uuid: str = '') -> str:
+        prompt = self.prompts['varied_message'].render(message=message)
 
         try:
-            response = self.model.generate_content(prompt)
-            reply = response.text.strip()
-            return reply
+            return self.generate_text('varied_message', prompt, group_uuid=group_uuid)
         except Exception as e:
             logger.error(f"Error generating varied message with Gemini: {e}")
             return message
@@ -746,7 +1389,7 @@ Message: '{message}'"""
                 "on_number": self.bot_number
             })
             
-            response = requests.post(url, headers=self.headers, data=payload)
+            response = self.http.post(url, headers=self.headers, data=payload)
             
             if response.status_code == 200 or response.status_code == 201:
                 logger.info(f"Successfully subscribed to {event_type} webhook: {webhook_url}")
@@ -765,7 +1408,7 @@ Message: '{message}'"""
             url = f"https://api.p.2chat.io/open/webhooks/{uuid}"
             
             payload = ""
-            response = requests.delete(url, headers=self.headers, data=payload)
+            response = self.http.delete(url, headers=self.headers, data=payload)
             
             if response.status_code == 200 or response.status_code == 204:
                 logger.info(f"Successfully unsubscribed webhook: {uuid}")
@@ -806,6 +1449,58 @@ Message: '{message}'"""
             logger.error(f"Error setting up webhooks: {e}")
             return False
             
+    def list_webhooks(self) -> List[Dict]:
+        """Webhook subscriptions of this 2Chat account; raises if they cannot be listed"""
+        response = self.http.get("https://api.p.2chat.io/open/webhooks", headers=self.headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+        return response.json().get('data', []) or []
+    
+    def reconcile_webhooks(self, base_url: str) -> bool:
+        """Make sure exactly one webhook per event points at base_url, reusing existing ones.
+
+        Duplicates and this bot's subscriptions at old URLs (e.g. old tunnel
+        URLs, recognised by the bot's route path) are removed; hooks of other
+        integrations on the number are left alone. Missing ones are created.
+        """
+        try:
+            existing = self.list_webhooks()
+        except Exception as e:
+            logger.warning(f"Could not list webhooks ({e}), subscribing without reconciliation")
+            return self.setup_webhooks(base_url)
+        
+        routes = {
+            "whatsapp.group.message.received": "/webhook",
+            "whatsapp.message.received": "/receive_chat_message",
+        }
+        uuids = {}
+        for event_type, route in routes.items():
+            hook_url = f"{base_url}{route}"
+            keep = None
+            for hook in existing:
+                event_name = hook.get('event_name') or hook.get('event') or ''
+                on_number = hook.get('on_number') or hook.get('channel_phone_number') or ''
+                if event_name != event_type or on_number != self.bot_number:
+                    continue
+                if keep is None and hook.get('hook_url') == hook_url:
+                    keep = hook.get('uuid', '')
+                    logger.info(f"Reusing {event_type} webhook {keep}: {hook_url}")
+                elif urlsplit(hook.get('hook_url') or '').path.rstrip('/') != route:
+                    logger.info(f"Leaving {event_type} webhook {hook.get('uuid')} of another integration: "
+                                f"{hook.get('hook_url')}")
+                else:
+                    logger.info(f"Removing stale {event_type} webhook {hook.get('uuid')}: {hook.get('hook_url')}")
+                    self.unsubscribe_webhook(hook.get('uuid', ''))
+            uuids[event_type] = keep or self.subscribe_webhook(hook_url, event_type)
+        
+        self.group_webhook_uuid = uuids["whatsapp.group.message.received"] or ""
+        self.private_webhook_uuid = uuids["whatsapp.message.received"] or ""
+        if self.group_webhook_uuid and self.private_webhook_uuid:
+            logger.info("All webhooks reconciled successfully!")
+            return True
+        logger.warning("Some webhooks failed to setup")
+        return False
+    
     def unetup_webhooks(self) -> bool:
         try:
             logger.info("Unsubscribing webhooks...")
@@ -830,20 +1525,32 @@ Message: '{message}'"""
     def init_weekly_progress(self):
         """Initialize/reset weekly progress on Monday at midnight"""
         logger.info("Initializing weekly progress for new week...")
+        self.ensure_warm()
+        
+        # Reset weekly progress for all groups; completions logged after the
+        # Saturday report are merged into that week's history
+        week_progress = self.take_weekly_progress()
+        self.archive_week_history(self.week_history_data(self.previous_week_start(), progress_by_group=week_progress))
+        self.persistence.flush()
         
-        # Reset weekly progress for all groups
-        self.weekly_progress = {}
-        self.save_weekly_progress()
+        # Full rediscovery once a week, so new groups are tracked from the week start
+        if self.discover_groups:
+            self.find_pilates_groups()
 
+    def schedule_jobs(self, scheduler):
+        """Register the weekly jobs on a `schedule` module or Scheduler"""
+        # Schedule Monday midnight progress initialization (Ireland timezone)
+        scheduler.every().monday.at("00:00").do(self.init_weekly_progress)
+        
+        # Schedule Saturday reports (Ireland timezone)
+        scheduler.every().saturday.at(config.SATURDAY_REPORT_TIME).do(self.saturday_report)
+    
     def start_scheduler(self):
         """Start the scheduled tasks in a separate thread"""
         logger.info("Starting scheduler for weekly reports and progress initialization...")
+        import schedule
         
-        # Schedule Monday midnight progress initialization (Ireland timezone)
-        schedule.every().monday.at("00:00").do(self.init_weekly_progress)
-        
-        # Schedule Saturday reports (Ireland timezone)
-        schedule.every().saturday.at(config.SATURDAY_REPORT_TIME).do(self.saturday_report)
+        self.schedule_jobs(schedule)
         
         # Run scheduler
         while True:
@@ -854,14 +1561,180 @@ Message: '{message}'"""
 # Global bot instance
 bot_instance = None
 
+# Tenant registry when hosting several bot numbers (TENANTS_FILE), else None
+tenant_registry = None
+
+# Worker processes owning group progress when SHARD_COUNT > 1, else None
+shard_pool = None
+
+# Optional recorder of inbound webhook traffic (WEBHOOK_CAPTURE_FILE)
+traffic_recorder = None
+
+def all_bots() -> List[WhatsAppPilatesBot]:
+    """Every bot hosted by this process"""
+    if tenant_registry is not None:
+        return tenant_registry.bots()
+    return [bot_instance] if bot_instance else []
+
+def resolve_bot(channel_phone_number: str):
+    """Bot that owns a webhook: the tenant for the channel number, or the single bot"""
+    if tenant_registry is not None:
+        return tenant_registry.get(channel_phone_number)
+    return bot_instance
+
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+FORWARDING_HEADERS = ('X-Forwarded-For', 'Forwarded', 'X-Real-IP')
+
+def is_admin_request(headers, remote_addr: str) -> bool:
+    """ADMIN_TOKEN as a bearer token, or without a token a direct loopback request.
+
+    ngrok and reverse proxies connect from loopback too, so requests carrying
+    forwarding headers never count as local.
+    """
+    if config.ADMIN_TOKEN:
+        supplied = headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {config.ADMIN_TOKEN}".encode('utf-8'))
+    return remote_addr in LOOPBACK_ADDRESSES and not any(headers.get(name) for name in FORWARDING_HEADERS)
+
 def create_app():
     """Create and configure Flask app"""
+    from flask import Flask, Response, g, request
+    
     app = Flask(__name__)
+    admission = admission_from_config(config)
+    # Auto replies run on the bots' executors and take their private-lane slot there
+    for bot in all_bots():
+        bot.admission = admission
+    completion_hint = re.compile(config.COMPLETION_HINT_PATTERN, re.IGNORECASE)
+    
+    def shed(full: LaneFull, handler, *args):
+        """Defer work for the lowest lane when allowed, otherwise reject it with 429"""
+        if full.lane == admission.lowest:
+            try:
+                admission.defer(handler, *args)
+                return {"status": "deferred"}, 202
+            except LaneFull:
+                pass
+        logger.warning(f"Lane {full.lane} is full, shedding webhook")
+        return {"error": "Too many requests", "lane": full.lane}, 429, {"Retry-After": str(full.retry_after)}
+    
+    @app.before_request
+    def start_request_trace():
+        # Correlation id from X-Request-ID (or a new one) for every span of this request
+        g.correlation_token = tracing.correlation_id.set(
+            tracing.new_correlation_id(request.headers.get('X-Request-ID', '')))
+        g.request_span = tracing.span(f"{request.method} {request.path}")
+        g.request_span.__enter__()
+    
+    @app.after_request
+    def add_request_id(response):
+        response.headers['X-Request-ID'] = tracing.correlation_id.get()
+        g.request_span.set('status', response.status_code)
+        return response
+    
+    @app.teardown_request
+    def end_request_trace(exc):
+        request_span = g.pop('request_span', None)
+        if request_span is not None:
+            request_span.__exit__(type(exc) if exc else None, exc, None)
+        token = g.pop('correlation_token', None)
+        if token is not None:
+            tracing.correlation_id.reset(token)
     
     @app.route("/", methods=["GET"])
     def index():
         return {"status": "WhatsApp Pilates Bot is running", "webhook": "/webhook"}, 200
 
+    def admin_only(view):
+        """Routes exposing member data or internals are not for the public webhook ingress"""
+        @functools.wraps(view)
+        def guarded(*args, **kwargs):
+            if not is_admin_request(request.headers, request.remote_addr or ''):
+                return {"error": "Forbidden"}, 403
+            return view(*args, **kwargs)
+        return guarded
+
+    @app.route("/metrics", methods=["GET"])
+    @admin_only
+    def metrics():
+        """Expose startup and runtime metrics"""
+        bots = all_bots()
+        if not bots:
+            return {"error": "Bot not ready"}, 500
+        if tenant_registry is not None:
+            return {"tenants": {bot.bot_number: {"metrics": bot.metrics_snapshot(), "warm": bot._warm.is_set()}
+                                for bot in bots}, "admission": admission.stats()}, 200
+        if shard_pool is not None:
+            return {"metrics": bot_instance.metrics, "shards": shard_pool.stats(), "tracing": tracing.stats(),
+                    "admission": admission.stats()}, 200
+        return {"metrics": bot_instance.metrics_snapshot(), "warm": bot_instance._warm.is_set(),
+                "tracing": tracing.stats(), "admission": admission.stats()}, 200
+
+    @app.route("/debug/profile", methods=["GET"])
+    @admin_only
+    def debug_profile():
+        """Sample all thread stacks for ?seconds=N (max 60); ?format=collapsed for flame graphs"""
+        if not config.PROFILER_ENABLED:
+            return {"error": "Profiler disabled"}, 404
+        seconds = min(max(request.args.get('seconds', 5, type=float), 0.1), 60)
+        interval = max(request.args.get('interval_ms', 10, type=float), 1) / 1000
+        try:
+            profile = profiler.sample_stacks(seconds, interval)
+        except profiler.ProfilerBusy as e:
+            return {"error": str(e)}, 409
+        if request.args.get('format') == 'collapsed':
+            return Response(profiler.collapsed(profile), mimetype='text/plain')
+        return {**profile, "stacks": dict(profile['stacks'].most_common(100))}, 200
+
+    def history_bot():
+        # ?bot=<number> picks the tenant when hosting several numbers
+        if tenant_registry is not None:
+            return tenant_registry.get(request.args.get('bot', ''))
+        return bot_instance
+
+    def timed(query):
+        started = time.perf_counter()
+        result = query()
+        return {"result": result, "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+    @app.route("/history/groups/<group_uuid>/completion-rate", methods=["GET"])
+    @admin_only
+    def history_completion_rate(group_uuid):
+        """Completion rate of a group over its last N weeks (?weeks=4)"""
+        bot = history_bot()
+        if not bot:
+            return {"error": "Bot not ready"}, 500
+        weeks = request.args.get('weeks', 4, type=int)
+        return timed(lambda: bot.history.completion_rate(group_uuid, weeks)), 200
+
+    @app.route("/history/groups/<group_uuid>/streaks", methods=["GET"])
+    @admin_only
+    def history_streaks(group_uuid):
+        """Current completion streak of every member of a group"""
+        bot = history_bot()
+        if not bot:
+            return {"error": "Bot not ready"}, 500
+        return timed(lambda: bot.history.streaks(group_uuid)), 200
+
+    @app.route("/history/groups/<group_uuid>/at-risk", methods=["GET"])
+    @admin_only
+    def history_at_risk(group_uuid):
+        """Members who missed each of the group's last N weeks (?weeks=2)"""
+        bot = history_bot()
+        if not bot:
+            return {"error": "Bot not ready"}, 500
+        weeks = request.args.get('weeks', 2, type=int)
+        return timed(lambda: bot.history.at_risk(group_uuid, weeks)), 200
+
+    @app.route("/history/members/<phone_number>/streaks", methods=["GET"])
+    @admin_only
+    def history_member_streaks(phone_number):
+        """Current streak of one member in each of their groups"""
+        bot = history_bot()
+        if not bot:
+            return {"error": "Bot not ready"}, 500
+        return timed(lambda: bot.history.member_streaks(phone_number)), 200
+
     @app.route("/webhook", methods=["POST"])
     def webhook():
         """Handle incoming webhooks from 2chat"""
@@ -870,16 +1743,68 @@ def create_app():
             return {"error": "Expected JSON"}, 400
         
         try:
-            data = request.get_json()
-            logger.info(f"Received webhook: {data}")
-            
-            # Process webhook with bot instance
-            if bot_instance:
-                bot_instance.process_webhook_message(data)
-            else:
+            if not all_bots():
                 logger.error("Bot instance not initialized")
                 return {"error": "Bot not ready"}, 500
             
+            raw = request.get_data(cache=False)
+            if request.headers.get('X-Self-Test') == '1':
+                # Startup ingress probe: decode like a real event, touch no state
+                with tracing.span('decode'):
+                    decode_group_message(raw)
+                return {"status": "self-test"}, 200
+            if traffic_recorder:
+                traffic_recorder.record('/webhook', raw)
+            
+            if shard_pool is not None:
+                # Parsing and classification happen in the shard owning the group
+                if PILATES_KEYWORD_BYTES not in raw.lower():
+                    return {"status": "ignored"}, 200
+                # Work runs in the shards, so lanes here are shard backlog limits: chatter gets
+                # SHARD_CHATTER_MAX_BACKLOG, completion candidates the whole queue
+                lane = 'completion' if completion_hint.search(message_text_of(raw)) else 'chatter'
+                max_backlog = config.SHARD_CHATTER_MAX_BACKLOG if lane == 'chatter' else 0
+                try:
+                    with tracing.span('shard_dispatch', lane=lane):
+                        shard_pool.dispatch_group_message(raw, max_backlog)
+                except WebhookDecodeError as e:
+                    logger.error(f"Invalid webhook payload: {e}")
+                    return {"error": str(e)}, 400
+                except queue.Full:
+                    admission.lanes[lane].count(admitted=False)
+                    if lane == 'chatter':
+                        return shed(LaneFull(lane, admission.retry_after), shard_pool.dispatch_group_message, raw)
+                    logger.warning("Shard queue full, rejecting webhook")
+                    return {"error": "Busy"}, 503
+                admission.lanes[lane].count(admitted=True)
+                bot_instance.record_webhook_accepted()
+                return {"status": "accepted"}, 200
+            
+            # Decode straight from the raw body; irrelevant groups are rejected before parsing
+            try:
+                with tracing.span('decode'):
+                    event = decode_group_message(raw)
+            except IgnoredEvent as e:
+                logger.debug(f"Ignored webhook: {e}")
+                return {"status": "ignored"}, 200
+            except WebhookDecodeError as e:
+                logger.error(f"Invalid webhook payload: {e}")
+                return {"error": str(e)}, 400
+            
+            bot = resolve_bot(event.channel_phone_number)
+            if bot is None:
+                logger.warning(f"No tenant for channel number {event.channel_phone_number}")
+                return {"status": "ignored"}, 200
+            
+            # Likely completion reports get their own lane; general chatter is shed first
+            lane = 'completion' if completion_hint.search(event.text) else 'chatter'
+            try:
+                with admission.admit(lane):
+                    bot.handle_group_event(event)
+            except LaneFull as full:
+                return shed(full, bot.handle_group_event, event)
+            bot.record_webhook_accepted()
+            
             return {"status": "success"}, 200
             
         except Exception as e:
@@ -894,16 +1819,32 @@ def create_app():
             return {"error": "Expected JSON"}, 400
         
         try:
-            data = request.get_json()
-            logger.info(f"Received chat message webhook: {data}")
-            
-            # Process chat message with bot instance
-            if bot_instance:
-                bot_instance.process_private_message(data)
-            else:
+            if not all_bots():
                 logger.error("Bot instance not initialized")
                 return {"error": "Bot not ready"}, 500
             
+            raw = request.get_data(cache=False)
+            if traffic_recorder:
+                traffic_recorder.record('/receive_chat_message', raw)
+            
+            try:
+                with tracing.span('decode'):
+                    event = decode_private_message(raw)
+            except WebhookDecodeError as e:
+                logger.error(f"Invalid chat message payload: {e}")
+                return {"error": str(e)}, 400
+            
+            bot = resolve_bot(event.channel_phone_number)
+            if bot is None:
+                logger.warning(f"No tenant for channel number {event.channel_phone_number}")
+                return {"status": "ignored"}, 200
+            
+            try:
+                bot.handle_private_event(event)
+            except LaneFull as full:
+                return shed(full, bot.handle_private_event, event)
+            bot.record_webhook_accepted()
+            
             return {"status": "success"}, 200
             
         except Exception as e:
@@ -912,9 +1853,138 @@ def create_app():
 
     return app
 
+def start_tunnel(ngrok_token: str, port: int = 5000) -> str:
+    """Open an ngrok tunnel to the local Flask server and return its public URL"""
+    from pyngrok import ngrok
+    
+    ngrok.set_auth_token(ngrok_token)
+    public_url = ngrok.connect(port).public_url
+    logger.info(f"ngrok tunnel URL: {public_url}")
+    print(f"🚀 Group Messages Webhook URL: {public_url}/webhook")
+    print(f"🚀 Private Messages Webhook URL: {public_url}/receive_chat_message")
+    return str(public_url)
+
+def configure_webhooks(bot: WhatsAppPilatesBot, public_url: str) -> bool:
+    """Reconcile the bot's webhooks and print manual instructions on failure"""
+    print(f"🔧 Setting up webhooks automatically for {bot.bot_number}...")
+    webhook_success = bot.reconcile_webhooks(public_url)
+    
+    if webhook_success:
+        print("✅ Webhooks configured successfully!")
+    else:
+        print("❌ Some webhooks failed to configure. You may need to set them up manually:")
+        print("📝 Manual configuration URLs:")
+        print("   - Use /webhook for group message events")
+        print("   - Use /receive_chat_message for private chat message events")
+    return webhook_success
+
+def wait_for_port(port: int, timeout: float = 30.0) -> bool:
+    """Wait until something accepts TCP connections on localhost:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def open_ingress(ngrok_token: str, port: int = 5000) -> str:
+    """Public base URL: PUBLIC_URL (own load balancer / reverse proxy) or an ngrok tunnel"""
+    if config.PUBLIC_URL:
+        public_url = config.PUBLIC_URL.rstrip('/')
+        logger.info(f"Using configured public URL: {public_url}")
+        return public_url
+    return start_tunnel(ngrok_token, port)
+
+def self_test_payload(bot: WhatsAppPilatesBot, n: int) -> bytes:
+    """Synthetic group message that decodes like a real one"""
+    return json.dumps({
+        "id": f"self-test-{n}",
+        "sent_by": "user",
+        "created_at": datetime.utcnow().isoformat(),
+        "channel_phone_number": bot.bot_number,
+        "message": {"text": "self-test"},
+        "participant": {"phone_number": "+0", "pushname": "self-test"},
+        "group": {"uuid": "self-test", "wa_group_name": f"{config.PILATES_KEYWORD} self-test",
+                  "wa_created_at": "2000-01-01T00:00:00Z"},
+    }).encode('utf-8')
+
+def run_ingress_self_test(bots: List[WhatsAppPilatesBot], public_url: str, port: int = 5000,
+                          count: int = None) -> Dict:
+    """Post synthetic events to /webhook locally and through the public URL, timing each.
+
+    Requests carry X-Self-Test: 1, so the handler decodes them and returns
+    without recording, classifying or storing anything.
+    """
+    count = config.WEBHOOK_SELF_TEST_EVENTS if count is None else count
+    if not count or not bots:
+        return {}
+    if not wait_for_port(port):
+        logger.warning(f"Self-test skipped: nothing listening on port {port}")
+        return {}
+    
+    http = requests.Session()
+    targets = {"local": f"http://127.0.0.1:{port}/webhook"}
+    if public_url:
+        targets["public"] = f"{public_url}/webhook"
+    headers = {"Content-Type": "application/json", "X-Self-Test": "1"}
+    
+    results = {}
+    for name, url in targets.items():
+        recorder = LatencyRecorder()
+        failures = 0
+        for n in range(count):
+            started = time.perf_counter()
+            try:
+                response = http.post(url, data=self_test_payload(bots[0], n), headers=headers, timeout=10)
+                ok = response.status_code == 200 and response.json().get("status") == "self-test"
+            except Exception as e:
+                logger.debug(f"Self-test request to {url} failed: {e}")
+                ok = False
+            if ok:
+                recorder.record(time.perf_counter() - started)
+            else:
+                failures += 1
+        results[name] = {"url": url, "failures": failures, **recorder.summary()}
+        level = logging.WARNING if failures else logging.INFO
+        logger.log(level, f"Ingress self-test ({name}): {results[name]}")
+    
+    for bot in bots:
+        bot.metrics['ingress_self_test'] = results
+    return results
+
+def background_startup(bots: List[WhatsAppPilatesBot], run_scheduler, ngrok_token: str, port: int = 5000):
+    """Lazy startup: once Flask listens, open the ingress, reconcile webhooks and warm caches"""
+    try:
+        if not wait_for_port(port):
+            logger.warning(f"Flask server not listening on port {port} yet, continuing startup anyway")
+        listening_seconds = round(time.monotonic() - STARTUP_T0, 3)
+        for bot in bots:
+            bot.metrics['listening_seconds'] = listening_seconds
+        logger.info(f"Startup: webhook endpoint listening {listening_seconds}s after process start")
+        
+        # Warm state and the Gemini model while the tunnel is being opened
+        warm_threads = [threading.Thread(target=bot.warm_up, daemon=True) for bot in bots]
+        for warm_thread in warm_threads:
+            warm_thread.start()
+        
+        public_url = open_ingress(ngrok_token, port)
+        for bot in bots:
+            configure_webhooks(bot, public_url)
+        run_ingress_self_test(bots, public_url, port)
+        
+        for warm_thread in warm_threads:
+            warm_thread.join()
+        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+        scheduler_thread.start()
+        logger.info("Scheduler started in background")
+    except Exception as e:
+        logger.error(f"Background startup failed: {e}")
+
 def main():
     """Main function to run the bot with Flask webhook"""
-    global bot_instance
+    global bot_instance, tenant_registry, shard_pool, traffic_recorder
     
     # Load configuration
     TWOCHAT_API_KEY = config.TWOCHAT_API_KEY
@@ -926,48 +1996,81 @@ def main():
         logger.error("Please set your Gemini API key in the GEMINI_API_KEY environment variable or config.py")
         return
     
-    if not TWOCHAT_API_KEY:
+    if not TWOCHAT_API_KEY and not config.TENANTS_FILE:
         logger.error("Please set your 2Chat API key in the TWOCHAT_API_KEY environment variable or config.py")
         return
     
-    if not NGROK_TOKEN:
-        logger.error("Please set your ngrok auth token in the NGROK_TOKEN environment variable or config.py")
+    if not NGROK_TOKEN and not config.PUBLIC_URL:
+        logger.error("Please set PUBLIC_URL, or your ngrok auth token in the NGROK_TOKEN environment variable or config.py")
         return
     
-    # Create bot instance
-    bot_instance = WhatsAppPilatesBot(
-        api_key=TWOCHAT_API_KEY,
-        gemini_api_key=GEMINI_API_KEY,
-        bot_number=BOT_NUMBER
-    )
+    # Span export (TRACE_EXPORT=file|otlp); correlation ids are set either way
+    tracing.configure(tracing.exporter_from_config(config))
+    
+    if config.TENANTS_FILE:
+        # Host every configured bot number in this process
+        from tenants import TenantRegistry
+        tenant_registry = TenantRegistry.from_file(
+            config.TENANTS_FILE,
+            bot_class=WhatsAppPilatesBot,
+            model=LazyGeminiModel(GEMINI_API_KEY),
+            lazy=config.LAZY_STARTUP
+        )
+        logger.info(f"Hosting {len(tenant_registry)} tenants from {config.TENANTS_FILE}")
+        run_scheduler = tenant_registry.start_scheduler
+    else:
+        # Create bot instance
+        bot_instance = WhatsAppPilatesBot(
+            api_key=TWOCHAT_API_KEY,
+            gemini_api_key=GEMINI_API_KEY,
+            bot_number=BOT_NUMBER,
+            lazy=config.LAZY_STARTUP
+        )
+        run_scheduler = bot_instance.start_scheduler
+        
+        if config.SHARD_COUNT > 1:
+            # Group progress is owned by worker processes, the parent keeps private replies
+            from sharding import ShardPool
+            shard_pool = ShardPool(bot_instance, config.SHARD_COUNT)
+            run_scheduler = shard_pool.start_scheduler
+            if config.LAZY_STARTUP:
+                threading.Thread(target=shard_pool.start, daemon=True).start()
+            else:
+                shard_pool.start()
+    
+    if config.WEBHOOK_CAPTURE_FILE:
+        traffic_recorder = TrafficRecorder(
+            config.WEBHOOK_CAPTURE_FILE,
+            bot_number=BOT_NUMBER or '',
+            salt=config.WEBHOOK_CAPTURE_SALT or load_or_create_salt(config.WEBHOOK_CAPTURE_SALT_FILE),
+            redact_text=config.WEBHOOK_CAPTURE_REDACT_TEXT
+        )
+        logger.info(f"Recording webhook traffic to {config.WEBHOOK_CAPTURE_FILE}")
+    
+    # Treat SIGTERM like Ctrl+C so webhooks are removed and pending state is written
+    def stop_on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
     
     # Create Flask app
     app = create_app()
     
     try:
-        # Start scheduler in background thread
-        scheduler_thread = threading.Thread(target=bot_instance.start_scheduler, daemon=True)
-        scheduler_thread.start()
-        logger.info("Scheduler started in background")
-        
-        # Start ngrok tunnel
-        ngrok.set_auth_token(NGROK_TOKEN)
-        public_url = ngrok.connect(5000).public_url
-        logger.info(f"ngrok tunnel URL: {public_url}")
-        print(f"🚀 Group Messages Webhook URL: {public_url}/webhook")
-        print(f"🚀 Private Messages Webhook URL: {public_url}/receive_chat_message")
-        
-        # Automatically setup webhooks
-        print("🔧 Setting up webhooks automatically...")
-        webhook_success = bot_instance.setup_webhooks(str(public_url))
-        
-        if webhook_success:
-            print("✅ Webhooks configured successfully!")
+        if config.LAZY_STARTUP:
+            # Bring the webhook endpoint up first, everything else follows in the background
+            startup_thread = threading.Thread(target=background_startup, args=(all_bots(), run_scheduler, NGROK_TOKEN), daemon=True)
+            startup_thread.start()
         else:
-            print("❌ Some webhooks failed to configure. You may need to set them up manually:")
-            print("📝 Manual configuration URLs:")
-            print("   - Use /webhook for group message events")
-            print("   - Use /receive_chat_message for private chat message events")
+            # Start scheduler in background thread
+            scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+            scheduler_thread.start()
+            logger.info("Scheduler started in background")
+            
+            # Open the ingress (PUBLIC_URL or ngrok) and reconcile webhooks
+            public_url = open_ingress(NGROK_TOKEN)
+            for bot in all_bots():
+                configure_webhooks(bot, public_url)
+            threading.Thread(target=run_ingress_self_test, args=(all_bots(), public_url), daemon=True).start()
         
         # Start Flask server
         logger.info("Starting Flask server on port 5000...")
@@ -975,9 +2078,22 @@ def main():
         
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-        bot_instance.unetup_webhooks(str(public_url))   
+        # A fixed PUBLIC_URL keeps its subscriptions for the next start; tunnel URLs change
+        if not config.PUBLIC_URL:
+            for bot in all_bots():
+                bot.unetup_webhooks()
     except Exception as e:
         logger.error(f"Bot crashed: {e}")
+    finally:
+        # Shards flush their debounced progress on 'stop'; they are daemons and die with us
+        if shard_pool is not None:
+            shard_pool.stop()
+        # Write whatever is still waiting for the background flusher
+        for bot in all_bots():
+            bot.persistence.stop()
+        if traffic_recorder:
+            traffic_recorder.close()
+        tracing.flush()
 
 if __name__ == "__main__":
     main()